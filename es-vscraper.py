@@ -18,21 +18,48 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import hmac
+import http.server
+import io
+import json
 from urllib.parse import urlparse
 import importlib
 import os
 import re
-import traceback
 import random
+import secrets
 import time
 import sys
 import shutil
+import copy
+import threading
+import queue
 import vscraper_utils
-from lxml import etree, objectify
-from fuzzywuzzy import fuzz
+import vscraper_db
+import vscraper_catalog
+import vscraper_names
+import vscraper_log
+
+# lxml and fuzzywuzzy are imported by the functions using them, to keep startup fast
+
+# progress and errors go through the queue-backed logger (set up by run_command())
+log = vscraper_log.log
 
 SCRAPERS_FOLDER = 'scrapers'
 
+# serialize gamelist updates and prompts when scraping with more workers
+_gamelist_lock = threading.Lock()
+_input_lock = threading.Lock()
+
+# parsed gamelists, by path: (stat stamp, { path: name })
+_gamelist_indexes = {}
+
+# <game> children, in the order add_game_entry() writes them
+GAME_FIELDS = ['name', 'developer', 'publisher', 'desc', 'genre', 'releasedate', 'path', 'image', 'thumbnail']
+
 
 def list_scrapers():
     """
@@ -59,6 +86,29 @@ def list_scrapers():
     return scrapers
 
 
+def has_capability(engine, capability):
+    """
+    check if a scraper declares a capability (through its optional capabilities() function)
+    :param engine: an engine module
+    :param capability: the capability (i.e. 'fields')
+    :return: bool
+    """
+    return hasattr(engine, 'capabilities') and capability in engine.capabilities()
+
+
+def run_choice(engine, choice, args):
+    """
+    get game_info for a choice (search listing or catalog entry), using the listing data if the engine supports it
+    :param engine: an engine module
+    :param choice: { name, publisher, year, url, system }
+    :param args: dictionary
+    :return: game_info dictionary
+    """
+    if has_capability(engine, 'listing'):
+        return vscraper_utils.run_listing_choice(choice, args, engine.run_direct_url)
+    return engine.run_direct_url(choice['url'], args)
+
+
 def get_scraper(engine):
     """
     get the desired scraper
@@ -84,40 +134,173 @@ def get_scraper(engine):
 
 def add_game_entry(args, root, game_info):
     """
-    adds/replace an entry to the gamelist xml
+    adds/replace an entry to the gamelist xml and to the store
     :param args: dictionary
-    :param root: 'gameList' root entry
+    :param root: 'gameList' root entry, or None to add to the store only ('--db_only')
     :param game_info: a dictionary
     :return:
     """
-
-    # check if game is already there
-    game = None
-    for g in root.findall('game'):
-        if g.path == game_info['path']:
-            # found, use this and replace content
-            game = g
-            print('Replacing entry: %s' % game_info['name'])
-            break
-
-    if game is None:
-        # create new entry
-        print('Creating entry: %s' % game_info['name'])
-        game = objectify.Element('game')
-
-    # fill values
-    game.name = game_info['name']
-    game.developer = game_info['developer']
-    game.publisher = game_info['publisher']
-    game.desc = game_info['desc'] or '-'
-    game.genre = game_info['genre']
-    game.releasedate = game_info['releasedate']
-    game.path = os.path.abspath(game_info['path'])
+    from lxml import objectify
+
+    store = vscraper_db.open_store(args.db)
+    path = os.path.abspath(game_info['path'])
+
+    # values, fields not asked for ('--fields') keep their existing values
+    entry = {'name': game_info['name'], 'path': path}
+    for f in ['developer', 'publisher', 'desc', 'genre', 'releasedate']:
+        if f in game_info:
+            entry[f] = game_info[f]
+    if 'desc' in entry:
+        entry['desc'] = entry['desc'] or '-'
     if game_info['image'] is not None:
-        game.image = os.path.abspath(game_info['image'])
+        entry['image'] = os.path.abspath(game_info['image'])
+    if game_info.get('thumbnail') is not None:
+        entry['thumbnail'] = os.path.abspath(game_info['thumbnail'])
+
+    if root is None:
+        # check if game is already there
+        old = store.get_game(path)
+        if old is not None:
+            log.info('Replacing entry: %s', game_info['name'])
+            old.update(entry)
+            entry = old
+        else:
+            log.info('Creating entry: %s', game_info['name'])
+    else:
+        # check if game is already there
+        game = None
+        for g in root.findall('game'):
+            if g.path == game_info['path']:
+                # found, use this and replace content
+                game = g
+                log.info('Replacing entry: %s', game_info['name'])
+                break
+
+        if game is None:
+            # create new entry
+            log.info('Creating entry: %s', game_info['name'])
+            game = objectify.Element('game')
+
+        # fill values
+        for f in GAME_FIELDS:
+            if f in entry:
+                setattr(game, f, entry[f])
+
+        # append entry
+        root.append(game)
+        entry = {c.tag: c.text for c in game.iterchildren()}
+
+    store.put_game(entry)
+
+    # remember the source page and its validators, for later revalidation
+    if game_info.get('url') is not None:
+        store.set_source(path, game_info['url'], vscraper_utils.get_validators(game_info['url']))
+
+
+def revalidate_entry(args):
+    """
+    check (with a conditional request) if the page an existing entry has been scraped from is unchanged
+    :param args: dictionary
+    :return: (True if unchanged, source url to scrape again or None)
+    """
+    source = vscraper_db.open_store(args.db).get_source(os.path.abspath(args.path))
+    if source is None or source[1]['content_hash'] is None:
+        # never scraped with validators
+        return False, None
+
+    try:
+        if vscraper_utils.is_unchanged(source[0], source[1]):
+            return True, None
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
+    except Exception as e:
+        return False, None
+
+    # changed, the reply is already prefetched for this url
+    return False, source[0]
+
+
+def get_image_path(args, root, name, blob):
+    """
+    get the image path for an entry, avoiding to overwrite images of other titles whose name normalizes the same
+    :param args: dictionary
+    :param root: 'gameList' root entry, or None to check the store ('--db_only')
+    :param name: the game name
+    :param blob: path to the image blob
+    :return: path
+    """
+    normalized = re.sub('[^0-9a-zA-Z]+', '-', name)
+
+    # image -> names of the entries using it
+    owners = {}
+    if root is not None:
+        for g in root.findall('game'):
+            if hasattr(g, 'image'):
+                owners.setdefault(str(g.image), []).append(str(g.name))
+
+    idx = 1
+    while True:
+        if idx == 1:
+            img_path = os.path.join(args.img_path, '%s.png' % normalized)
+        else:
+            img_path = os.path.join(args.img_path, '%s-%d.png' % (normalized, idx))
 
-    # append entry
-    root.append(game)
+        conflict = False
+        if os.path.exists(img_path) and not os.path.samefile(img_path, blob):
+            # different image, check if it belongs to another title
+            if root is None:
+                owners[os.path.abspath(img_path)] = vscraper_db.open_store(args.db).get_image_owners(
+                    os.path.abspath(img_path))
+            for n in owners.get(os.path.abspath(img_path), []):
+                if not n.startswith(name):
+                    conflict = True
+                    break
+
+        if not conflict:
+            return img_path
+        idx += 1
+
+
+def gc_images(args):
+    """
+    delete the stored images which are not referenced anymore by the entries of the gamelist and/or the store
+    """
+    if args.img_path is None:
+        args.img_path = os.path.join(os.path.dirname(os.path.abspath(args.gamelist_path)), 'images')
+
+    # collect the <image>/<thumbnail> paths (relative to the gamelist folder, as emulationstation does)
+    referenced = set()
+    hashes = {}
+    sources = 0
+    if args.gamelist_path is not None and os.path.exists(args.gamelist_path):
+        sources += 1
+        folder = os.path.dirname(os.path.abspath(args.gamelist_path))
+        for entry in iter_game_entries(args.gamelist_path):
+            for tag in ('image', 'thumbnail'):
+                if entry.get(tag):
+                    referenced.add(os.path.abspath(os.path.join(folder, entry[tag])))
+
+    if args.db is None and args.gamelist_path is not None:
+        args.db = os.path.join(os.path.dirname(os.path.abspath(args.gamelist_path)), vscraper_db.DB_NAME)
+    if args.db is not None and os.path.exists(args.db):
+        sources += 1
+        store = vscraper_db.open_store(args.db)
+        for folder in store.folders():
+            for entry in store.iter_games(folder):
+                for tag in ('image', 'thumbnail'):
+                    if entry.get(tag):
+                        referenced.add(os.path.abspath(os.path.join(folder, entry[tag])))
+        hashes = store.get_image_hashes()
+
+    if sources == 0:
+        # nothing to tell which images are in use, do not delete them all
+        log.error('no gamelist or store found to collect the referenced images from, nothing done')
+        return
+
+    images, blobs, freed = vscraper_utils.gc_image_blobs(args.img_path, referenced, hashes,
+                                                          args.preprocess_test is True)
+    log.info('done, removed %d unreferenced images and %d blobs (%d bytes) in %s !', images, blobs, freed,
+             args.img_path)
 
 
 def scrape_move_delete(args):
@@ -130,33 +313,334 @@ def scrape_move_delete(args):
         renamed = os.path.join(os.path.abspath(args.dumpbin),
                                os.path.basename(os.path.abspath(args.path)))
         shutil.move(args.path, renamed)
-        print('Non-scraped file %s moved to: %s' % (args.path, renamed))
+        log.info('Non-scraped file %s moved to: %s', args.path, renamed)
     else:
         # check for deletion
         if args.delete_no_scraped == True:
             os.remove(args.path)
-            print('DELETED non-scraped file: %s' % (args.path))
+            log.info('DELETED non-scraped file: %s', args.path)
 
 
-def scrape_title(engine, args):
+def catalog_choices(engine, args):
     """
-    scrape a single title
+    resolve args.to_search on the local catalog (exact and fuzzy lookups both go through the memory-mapped index)
+    :param engine: an engine module
+    :param args: dictionary
+    :return: [{ name, publisher, year, url, system }], a single one if resolved, empty if not found (or no catalog)
+    """
+    index = vscraper_catalog.get_fuzzy_index(engine, args)
+    if index is None:
+        return []
+
+    hits = index.lookup(args.to_search)
+    vscraper_log.cache_lookup(len(hits) > 0)
+    if len(hits) == 1:
+        log.info('Found "%s" in catalog: %s', args.to_search, hits[0]['url'])
+    if len(hits) > 0:
+        return hits
+
+    # no exact match, try the closest ones
+    hits = [h for h in index.search(args.to_search, args.catalog_top) if h['score'] >= args.catalog_min_score]
+    if len(hits) == 1 or (len(hits) > 1 and hits[0]['score'] == 100 and hits[1]['score'] < 100):
+        log.info('Found "%s" in catalog: %s (%s, score=%d)', args.to_search, hits[0]['name'],
+                 hits[0]['url'], hits[0]['score'])
+        return hits[:1]
+    return hits
+
+
+def run_engine(engine, args):
+    """
+    query the engine for args.to_search, resolving it on the local catalog first if '--catalog' is specified
+    :param engine: an engine module
+    :param args: dictionary
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :throws vscraper_utils.MultipleChoicesException when multiple choices are found
+    :return: game_info dictionary
+    """
+    if args.catalog:
+        hits = catalog_choices(engine, args)
+        if len(hits) == 1:
+            return run_choice(engine, hits[0], args)
+        if len(hits) > 1:
+            raise vscraper_utils.MultipleChoicesException(hits)
+
+    # search online
+    return engine.run(args)
+
+
+def run_engine_variants(engine, args, store):
+    """
+    run the engine and, with '--variants', retry a title not found with variants of the query (within
+    '--variants_budget' search requests). The variant found is remembered for the next time
+    :param engine: an engine module
+    :param args: arguments from cmdline, 'to_search' is set to the variant found
+    :param store: the Store
+    :throws vscraper_utils.GameNotFoundException, vscraper_utils.MultipleChoicesException as the engine
+    :return: game_info as the engine
+    """
+    if not args.variants:
+        return run_engine(engine, args)
+
+    query = args.to_search
+    variant = store.get_search_variant(engine.name(), query)
+    vscraper_log.cache_lookup(variant is not None)
+    if variant is not None:
+        # found before
+        args.to_search = variant
+        try:
+            return run_engine(engine, args)
+        except vscraper_utils.GameNotFoundException as e:
+            args.to_search = query
+
+    try:
+        return run_engine(engine, args)
+    except vscraper_utils.GameNotFoundException as e:
+        not_found = e
+
+    # only the searches count against the budget (enforced by http_get(), so a search never issues the request
+    # past it): the game page and images of the variant found are downloaded anyway
+    choices = []
+    vscraper_utils.set_request_limit(vscraper_utils.get_request_count() + args.variants_budget)
+    try:
+        for variant in vscraper_names.query_variants(query):
+            log.info('Cannot find "%s", trying "%s"...', query, variant)
+            args.to_search = variant
+            try:
+                choices = catalog_choices(engine, args) if args.catalog else []
+                if len(choices) == 0:
+                    choices = engine.search(args)
+            except vscraper_utils.GameNotFoundException as e:
+                continue
+            except vscraper_utils.RequestBudgetException as e:
+                log.warning('Giving up on variants of "%s" (%d requests)', query, args.variants_budget)
+                break
+            if len(choices) > 0:
+                break
+    finally:
+        vscraper_utils.set_request_limit(None)
+
+    if len(choices) == 0:
+        args.to_search = query
+        raise not_found
+
+    store.set_search_variant(engine.name(), query, args.to_search)
+    if len(choices) > 1:
+        raise vscraper_utils.MultipleChoicesException(choices)
+    return run_choice(engine, choices[0], args)
+
+
+def build_catalog(engine, args):
+    """
+    crawl the engine into its local catalog
+    """
+    path = vscraper_catalog.build_catalog(engine, args)
+    log.info('done, catalog written to %s !', path)
+
+
+def prepare_store(args, folder):
+    """
+    set the default images, gamelist and store paths for a folder, and open the store
+    :param args: dictionary
+    :param folder: the folder being scraped
+    :return: Store
+    """
+    if args.img_path is None:
+        # use path/images as images path
+        args.img_path = os.path.join(folder, 'images')
+
+    if args.gamelist_path is None:
+        # use path/gamelist.xml as gamelist path
+        args.gamelist_path = os.path.join(folder, 'gamelist.xml')
+
+    if args.db is None:
+        # use path/.es-vscraper.db as store path
+        args.db = os.path.join(os.path.dirname(args.gamelist_path), vscraper_db.DB_NAME)
+
+    store = vscraper_db.open_store(args.db)
+    if args.db_only and store.count_games(folder) == 0 and os.path.exists(args.gamelist_path):
+        # first use of the store for this folder, import the existing gamelist
+        log.info('Importing XML: %s', args.gamelist_path)
+        store.put_games(absolute_entry_paths(iter_game_entries(args.gamelist_path),
+                                             os.path.dirname(os.path.abspath(args.gamelist_path))))
+    return store
+
+
+def store_image_blob(args, game_info):
+    """
+    write the image to its blob as soon as it is converted, so the buffer is not carried any further
+    :param args: dictionary
+    :param game_info: a dictionary, 'img_buffer' is replaced by 'img_blob' (path to the blob, or None) and
+        'img_variants' ({ size: path to the variant blob })
+    :return:
+    """
+    game_info['img_blob'] = None
+    game_info['img_variants'] = {}
+    if game_info['img_buffer'] is not None:
+        # store image, ensuring folder exists
+        try:
+            os.mkdir(args.img_path)
+        except FileExistsError:
+            pass
+        game_info['img_blob'] = vscraper_utils.get_image_blob(args.img_path, game_info['img_buffer'])
+        if args.img_variants is not None:
+            game_info['img_variants'] = vscraper_utils.get_image_variant_blobs(game_info['img_blob'],
+                                                                               args.img_variants)
+
+    # drop the buffer
+    game_info['img_buffer'] = None
+
+
+def commit_game_info(args, store, game_info):
+    """
+    link the image and add the entry (or entries, with '--append_auto') to the gamelist and the store
+    :param args: dictionary
+    :param store: the Store
+    :param game_info: a dictionary
+    :return:
+    """
+    from lxml import etree, objectify
+
+    # create xml
+    if args.db_only:
+        # store only
+        xml = None
+    elif os.path.exists(args.gamelist_path):
+        # read existing
+        xml = objectify.fromstring(
+            vscraper_utils.read_from_file(args.gamelist_path))
+    else:
+        # create new
+        xml = objectify.Element('gameList')
+
+    if game_info['img_blob'] is not None:
+        # images are stored once by content, and linked by name
+        blob = game_info['img_blob']
+        img_path = get_image_path(args, xml, game_info['name'], blob)
+        vscraper_utils.link_image_blob(blob, img_path)
+        store.set_image(os.path.abspath(img_path), os.path.splitext(os.path.basename(blob))[0])
+
+        # variants are linked alongside, as <image name>_<size>.png
+        paths = {0: img_path}
+        for size, variant in game_info['img_variants'].items():
+            paths[size] = '%s_%d.png' % (os.path.splitext(img_path)[0], size)
+            vscraper_utils.link_image_blob(variant, paths[size])
+            store.set_image(os.path.abspath(paths[size]), os.path.splitext(os.path.basename(variant))[0])
+
+        # add paths to dictionary
+        game_info['image'] = paths[args.img_image_size]
+        game_info['thumbnail'] = paths.get(args.img_thumbnail_size)
+    else:
+        game_info['image'] = None
+        game_info['thumbnail'] = None
+
+    # add title path to dictionary
+    game_info['path'] = args.path
+
+    # add entry
+    if args.append_auto == 0:
+        # single entry
+        add_game_entry(args, xml, game_info)
+    else:
+        # add multiple entries
+        idx = 1
+        base_name = game_info['name']
+        base_path = game_info['path']
+        for idx in range(1, args.append_auto + 1):
+            idx_str = str(idx)
+            # generates a new path
+            ext = os.path.splitext(base_path)[1]
+            path_no_ext = os.path.splitext(base_path)[0]
+            if idx < 10:
+                dsk_path = path_no_ext[:-1] + idx_str
+            else:
+                dsk_path = path_no_ext[:-2] + idx_str
+
+            new_path = dsk_path + ext
+            game_info['path'] = new_path
+
+            # generates a new name
+            name = base_name
+            name += (' (disk %s)' % idx_str)
+            game_info['name'] = name
+
+            # add entry
+            add_game_entry(args, xml, game_info)
+
+    if xml is not None:
+        # rewrite
+        log.info('Writing XML: %s', args.gamelist_path)
+        objectify.deannotate(xml)
+        etree.cleanup_namespaces(xml)
+        s = etree.tostring(xml, pretty_print=True)
+
+        # replace at once, the fetching workers may be reading it
+        tmp_path = '%s.tmp' % args.gamelist_path
+        vscraper_utils.write_to_file(tmp_path, s)
+        os.replace(tmp_path, args.gamelist_path)
+
+
+def get_search_filename(args):
+    """
+    get the filename to derive the search key from: the name of the file at '--path' or, with '--archive_names',
+    the name of the (largest) file inside the archive if more descriptive
+    :param args: dictionary
+    :return: file name
+    """
+    name = os.path.basename(args.path)
+    if not args.archive_names or args.archive_member is None:
+        return name
+
+    inner = os.path.basename(args.archive_member[0])
+    if vscraper_names.name_score(inner) > vscraper_names.name_score(name):
+        log.info('Using the name inside "%s": %s', name, inner)
+        return inner
+    return name
+
+
+def run_engine_crc(engine, args, store):
+    """
+    look up the archive at '--path' in the crc index: a known url is downloaded directly, while a known title
+    becomes the search key
+    :param engine: an engine module
+    :param args: arguments from cmdline
+    :param store: the Store
+    :return: game_info as the engine, or None if the url is not known
+    """
+    if args.archive_member is None:
+        return None
+    hit = store.get_crc(engine.name(), args.archive_member[2], args.archive_member[1])
+    vscraper_log.cache_lookup(hit is not None)
+    if hit is None:
+        return None
+
+    name, url = hit
+    if url is None:
+        log.info('Found "%s" in the crc index as "%s"', args.to_search, name)
+        args.to_search = name
+        return None
+    log.info('Found "%s" in the crc index: %s', args.to_search, url)
+    return engine.run_direct_url(url, args)
+
+
+def fetch_title(engine, args):
+    """
+    first stage of scrape_title(): query the engine for a title and store its image
     :param engine an engine module
     :param args dictionary
-    :return: 0 on success, -1 on not found on disk, -2 on skip, -3 on not found on server
+    :return: (scrape_title() result, game_info), game_info is None unless result is 0
     """
     args.path = os.path.abspath(args.path)
     if not os.path.exists(args.path):
         if not args.download_url:
-            print('%s not found!' % args.path)
-            return -1
+            log.error('%s not found!', args.path)
+            return -1, None
 
     if args.download_url:
         if args.name_from_url is True:
             # ensure path is a dir
             if not os.path.isdir(args.path):
-                print('ERROR, --path must point to a folder!')
-                return -1
+                log.error('ERROR, --path must point to a folder!')
+                return -1, None
 
             # derive name from url and create path
             parsed = urlparse(args.download_url)
@@ -165,73 +649,114 @@ def scrape_title(engine, args):
         else:
             # ensure path is a file
             if os.path.isdir(args.path):
-                print('ERROR, --path must point to a file!')
-                return -1
+                log.error('ERROR, --path must point to a file!')
+                return -1, None
         
         # try to download from url
-        print('DOWNLOADING %s to %s' % (args.download_url, args.path))
+        log.info('DOWNLOADING %s to %s', args.download_url, args.path)
         try:
             dwn_res = vscraper_utils.download_file(args.download_url, args.path, args.download_no_overwrite)
             if dwn_res == -1:
-                print('ALREADY EXISTS: %s (no overwrite)' % (args.path))
+                log.info('ALREADY EXISTS: %s (no overwrite)', args.path)
 
         except Exception as e:
-            print('ERROR DOWNLOADING %s to %s' % (args.download_url, args.path))
-            return -1
+            log.error('ERROR DOWNLOADING %s to %s', args.download_url, args.path)
+            return -1, None
         
+    # the largest file inside the archive, if any
+    args.archive_member = None
+    if args.archive_names or args.crc:
+        members = vscraper_utils.read_archive_members(args.path)
+        if members is not None and len(members) > 0:
+            args.archive_member = max(members, key=lambda m: m[1])
+
+    args.name_hints = None
     if args.to_search is None:
-        ts = args.path
+        ts = get_search_filename(args)
         if args.trunc_at is not None:
             # truncate at the first occurrence of the given character/s
-            l = re.match(('(.[^%s]+)' % re.escape(args.trunc_at)), os.path.basename(ts))
+            l = re.match(('(.[^%s]+)' % re.escape(args.trunc_at)), ts)
             args.to_search = l[0].strip()
+        elif args.normalize:
+            # strip the tags, keeping year/publisher as hints
+            args.name_hints = vscraper_names.parse_filename(ts)
+            args.to_search = args.name_hints['name']
         else:
             # to_search (name to be queried by scraper) is the filename without extension
-            args.to_search = os.path.splitext(os.path.basename(ts))[0]
+            args.to_search = os.path.splitext(ts)[0]
 
-    if args.img_path is None:
-        # use path/images as images path
-        args.img_path = os.path.join(os.path.dirname(args.path), 'images')
-
-    if args.gamelist_path is None:
-        # use path/gamelist.xml as gamelist path
-        args.gamelist_path = os.path.join(
-            os.path.dirname(args.path), 'gamelist.xml')
+    store = prepare_store(args, os.path.dirname(args.path))
 
     # check if the game is already listed in the gamelist_path
-    if os.path.exists(args.gamelist_path):
-        xml = objectify.fromstring(vscraper_utils.read_from_file(args.gamelist_path))
-        for g in xml.findall('game'):
-            if g.path == os.path.abspath(args.path) and args.overwrite is None:
-                # if so, it must be skipped (not overwritten)
-                print('Skipping entry (already present): %s, %s' % (g['name'], g.path))
-                return -2
+    existing = None
+    source_url = None
+    if args.db_only:
+        existing = store.get_game(args.path)
+    elif os.path.exists(args.gamelist_path):
+        index = get_gamelist_index(args.gamelist_path)
+        if args.path in index:
+            existing = {'name': index[args.path], 'path': args.path}
+
+    if existing is not None:
+        if args.overwrite is None:
+            # if so, it must be skipped (not overwritten)
+            log.info('Skipping entry (already present): %s, %s', existing['name'], existing['path'],
+                     extra={'event': 'skipped', 'path': args.path, 'result': -2})
+            return -2, None
+
+        if args.revalidate:
+            unchanged, source_url = revalidate_entry(args)
+            if unchanged:
+                # keep the existing entry
+                log.info('Keeping entry (unchanged on server): %s, %s', existing['name'], existing['path'])
+                return -2, None
 
     try:
-        print('Downloading data for "%s" (%s, system=%s)...' % (args.to_search, os.path.abspath(
-            args.path), '-' if args.engine_params is None else args.engine_params))
-        game_info = engine.run(args)
+        log.info('Downloading data for "%s" (%s, system=%s)...', args.to_search, os.path.abspath(args.path),
+                 '-' if args.engine_params is None else args.engine_params)
+        game_info = None
+        if source_url is not None:
+            # scrape the changed page again, no need to search
+            log.info('Source page changed for "%s": %s', args.to_search, source_url)
+            game_info = engine.run_direct_url(source_url, args)
+        if game_info is None and args.crc:
+            game_info = run_engine_crc(engine, args, store)
+        if game_info is None:
+            game_info = run_engine_variants(engine, args, store)
     except vscraper_utils.GameNotFoundException as e:
-        print('Cannot find "%s", scraper="%s"' % (args.to_search, engine.name()))
+        log.warning('Cannot find "%s", scraper="%s"', args.to_search, engine.name(),
+                    extra={'event': 'not_found', 'path': args.path, 'engine': engine.name(), 'query': args.to_search,
+                           'result': -3})
+        store.add_scrape(args.path, engine.name(), args.to_search, -3)
         scrape_move_delete(args)
-        return -3
+        return -3, None
 
     except vscraper_utils.MultipleChoicesException as e:
-        print('Multiple titles found for "%s":' % args.to_search)
-        i = 1
-        for choice in e.choices():
-            print('%s: [%s] %s, %s, %s' % (i, choice['system'] if 'system' in choice else '-',
-                                           choice['name'], choice['publisher'], choice['year'] if 'year' in choice else '?'))
-            i += 1
-
-        # ask using timeout, if any
-        timeout = int(args.unattended_timeout)
-        res = vscraper_utils.input_with_timeout(
-            'choose (1-%d, 0 to delete/move): ' % (i - 1), timeout)
+        picked = vscraper_names.pick_choice(e.choices(), args.name_hints)
+        if picked is not None:
+            # year/publisher from the filename agree with a single choice
+            log.info('Multiple titles found for "%s", choosing #%d from the filename', args.to_search, picked + 1)
+            res = str(picked + 1)
+        else:
+            with _input_lock, vscraper_log.terminal():
+                # one prompt at a time, on a quiet terminal
+                print('Multiple titles found for "%s":' % args.to_search)
+                i = 1
+                for choice in e.choices():
+                    print('%s: [%s] %s, %s, %s' % (i, choice['system'] if 'system' in choice else '-',
+                                                   choice['name'], choice['publisher'], choice['year'] if 'year' in choice else '?'))
+                    i += 1
+
+                # ask using timeout, if any
+                timeout = int(args.unattended_timeout)
+                res = vscraper_utils.input_with_timeout(
+                    'choose (1-%d, 0 to delete/move): ' % (i - 1), timeout)
+
         if res == '0':
             # delete/move
+            store.add_scrape(args.path, engine.name(), args.to_search, -3)
             scrape_move_delete(args)
-            return -3
+            return -3, None
 
         elif res == '':
             # use the first entry
@@ -239,9 +764,16 @@ def scrape_title(engine, args):
 
         # reissue with the correct entry
         c = e.choices()[int(res) - 1]
-        print('Downloading data for "%s": %s, %s, %s' %
-              (args.to_search, c['name'], c['publisher'], c['year']))
-        game_info = engine.run_direct_url(c['url'], args)
+        log.info('Downloading data for "%s": %s, %s, %s', args.to_search, c['name'], c['publisher'], c['year'])
+        game_info = run_choice(engine, c, args)
+
+    if args.fields is not None:
+        # drop what was not asked for, in case the engine got it anyway
+        for f in vscraper_utils.FIELDS:
+            if f not in args.fields and f != 'name':
+                game_info.pop(f, None)
+        if 'image' not in args.fields:
+            game_info['img_buffer'] = None
 
     # check for append
     if args.path_is_dir is True:
@@ -253,174 +785,793 @@ def scrape_title(engine, args):
         # append this string to name
         game_info['name'] += (' ' + args.append)
 
-    if game_info['img_buffer'] is not None:
-        # store image, ensuring folder exists
-        try:
-            os.mkdir(args.img_path)
-        except FileExistsError:
-            pass
+    store_image_blob(args, game_info)
+    return 0, game_info
+
+
+def commit_title(engine, args, game_info):
+    """
+    second stage of scrape_title(): add a fetched title to the gamelist and the store
+    :param engine an engine module
+    :param args dictionary
+    :param game_info: from fetch_title()
+    :return:
+    """
+    store = vscraper_db.open_store(args.db)
+    with _gamelist_lock:
+        # one writer at a time
+        commit_game_info(args, store, game_info)
+
+    store.add_scrape(args.path, engine.name(), args.to_search, 0)
+    if args.crc and args.archive_member is not None and game_info.get('url') is not None:
+        # next time, no search needed
+        store.put_crcs([(engine.name(), args.archive_member[2], args.archive_member[1], game_info['name'],
+                         game_info['url'])])
+    log.info('Successfully processed "%s": %s (%s)', args.to_search, game_info['name'], args.path,
+             extra={'event': 'scraped', 'path': args.path, 'engine': engine.name(), 'query': args.to_search,
+                    'result': 0})
+    log.debug('%s', game_info)
+
+
+def scrape_title(engine, args):
+    """
+    scrape a single title
+    :param engine an engine module
+    :param args dictionary
+    :return: 0 on success, -1 on not found on disk, -2 on skip, -3 on not found on server
+    """
+    res, game_info = fetch_title(engine, args)
+    if res == 0:
+        commit_title(engine, args, game_info)
+    return res
+
+
+def scrape_folder_entry(mod, args, game_path):
+    """
+    scrape a single file of a folder
+    :param mod: an engine module
+    :param args: dictionary (not modified)
+    :param game_path: path to the file
+    :return: scrape_title() result, -5 if the site is unavailable (to be retried later), or None on error
+    """
+    try:
+        # process entry
+        a = copy.copy(args)
+        a.path = game_path
+        a.to_search = None
+        return scrape_title(mod, a)
+
+    except vscraper_utils.HostUnavailableException as e:
+        log.warning('Site unavailable, requeued "%s": %s', game_path, e, extra={'event': 'requeued', 'path': game_path})
+        return -5
+
+    except Exception as e:
+        # show error and continue
+        log.exception('Error processing "%s"', game_path)
+        return None
+
+
+def scrape_pipeline(mod, args, files):
+    """
+    scrape files with '--workers' fetching threads feeding a single writer (this thread), through bounded queues:
+    workers block when the writer is behind, so only a few fetched titles (images are already on disk) are held at once
+    :param mod: an engine module
+    :param args: dictionary (not modified)
+    :param files: paths to the files
+    :return: [path] of the files to be retried later (site unavailable)
+    """
+    todo = queue.Queue(maxsize=args.workers * 2)
+    fetched = queue.Queue(maxsize=args.workers * 2)
+    requeued = []
+
+    def _feed():
+        for f in files:
+            todo.put(f)
+        for _ in range(args.workers):
+            # one stop marker per worker
+            todo.put(None)
+
+    def _fetch():
+        while True:
+            f = todo.get()
+            if f is None:
+                fetched.put(None)
+                return
+
+            a = copy.copy(args)
+            a.path = f
+            a.to_search = None
+            try:
+                res, game_info = fetch_title(mod, a)
+            except vscraper_utils.HostUnavailableException as e:
+                log.warning('Site unavailable, requeued "%s": %s', f, e, extra={'event': 'requeued', 'path': f})
+                requeued.append(f)
+                continue
+            except Exception as e:
+                # show error and continue
+                log.exception('Error processing "%s"', f)
+                vscraper_log.title_done()
+                continue
+
+            if res == 0:
+                fetched.put((a, game_info))
+            else:
+                vscraper_log.title_done()
+
+    vscraper_log.add_gauge('todo', todo.qsize)
+    vscraper_log.add_gauge('fetched', fetched.qsize)
+    threads = [threading.Thread(target=_feed, daemon=True)]
+    threads += [threading.Thread(target=_fetch, daemon=True) for _ in range(args.workers)]
+    for t in threads:
+        t.start()
+
+    # write until every worker is done
+    running = args.workers
+    while running > 0:
+        item = fetched.get()
+        if item is None:
+            running -= 1
+            continue
+        try:
+            commit_title(mod, item[0], item[1])
+        except Exception as e:
+            # show error and continue
+            log.exception('Error processing "%s"', item[0].path)
+        vscraper_log.title_done()
+
+    for t in threads:
+        t.join()
+    vscraper_log.remove_gauge('todo')
+    vscraper_log.remove_gauge('fetched')
+    return requeued
+
+
+def scrape_files(mod, args, files):
+    """
+    scrape some files of a folder, concurrently with '--workers' or else sleeping between them
+    :param mod: an engine module
+    :param args: dictionary (not modified)
+    :param files: paths to the files
+    :return: [path] of the files to be retried later (site unavailable)
+    """
+    if args.workers > 1:
+        return scrape_pipeline(mod, args, files)
+
+    requeued = []
+    for idx, f in enumerate(files):
+        res = scrape_folder_entry(mod, args, f)
+        if res == -5:
+            requeued.append(f)
+        else:
+            vscraper_log.title_done()
+        if (res == 0 or res == -3) and idx < len(files) - 1:
+            # sleep between 1 and sleep (avoid hammering)
+            seconds = random.randint(1, int(args.sleep))
+            time.sleep(seconds)
+    return requeued
+
+
+def is_folder_entry(name):
+    """
+    check if a file in a scraped folder is a game (not the gamelist or the store)
+    :param name: the file name
+    :return: bool
+    """
+    return not name.lower().startswith('gamelist.xml') and not name.startswith(vscraper_db.DB_NAME)
+
+
+def scrape_folder(mod, args):
+    """
+    scrape an entire folder, based on filenames
+    """
+
+    # get all files in folder
+    args.path = os.path.abspath(args.path)
+    args.path_is_dir = True
+    prepare_store(args, args.path)
+    files = []
+    for f in os.listdir(args.path):
+        if os.path.isdir(os.path.join(args.path, f)):
+            # skip subfolders
+            continue
+        if not is_folder_entry(f):
+            # skip gamelist and store
+            continue
+        files.append(os.path.join(args.path, f))
+    vscraper_log.set_total(len(files))
+
+    if args.workers > 1:
+        # requests are paced by the per-host concurrency control
+        vscraper_utils.set_max_host_concurrency(args.workers)
+        vscraper_utils.set_max_inflight_bytes(args.max_inflight_mb * 1024 * 1024)
+
+    for rnd in range(args.requeue + 1):
+        if rnd > 0:
+            if len(files) == 0:
+                break
+            log.info('Retrying %d requeued files (round %d/%d)...', len(files), rnd, args.requeue)
+
+        requeued = scrape_files(mod, args, files)
+        files = requeued
+
+    if len(files) > 0:
+        log.warning('Giving up on %d files, site unavailable: %s', len(files), ', '.join(files))
+
+    # done
+    if args.db_only:
+        # regenerate the gamelist from the store
+        export_gamelist(args, args.path)
+
+
+def remove_folder_entries(args, paths):
+    """
+    remove the entries of deleted files from the gamelist and the store (the files are gone already)
+    :param args: dictionary
+    :param paths: paths to the files
+    :return:
+    """
+    matcher = vscraper_utils.compile_patterns(['%s$' % re.escape(p) for p in paths])
+    if not args.db_only and os.path.exists(args.gamelist_path):
+        with _gamelist_lock:
+            tmp_path = '%s.tmp' % args.gamelist_path
+            removed = drop_game_entries(args.gamelist_path, tmp_path, matcher)
+            os.replace(tmp_path, args.gamelist_path)
+        for path, name in removed:
+            log.info('Removed entry (file deleted): %s, %s', name, path)
+
+    vscraper_db.open_store(args.db).delete_games(paths)
+
+
+def watch_folder(mod, args):
+    """
+    scrape the files added to (or renamed in) a folder as they appear, until interrupted
+    """
+    import vscraper_watch
+
+    args.path = os.path.abspath(args.path)
+    args.path_is_dir = True
+    prepare_store(args, args.path)
+    if args.workers > 1:
+        # requests are paced by the per-host concurrency control
+        vscraper_utils.set_max_host_concurrency(args.workers)
+        vscraper_utils.set_max_inflight_bytes(args.max_inflight_mb * 1024 * 1024)
+
+    # file name -> time of its last event, scraped once settled
+    pending = {}
+    deleted = set()
+    watcher = vscraper_watch.open_watcher(args.path)
+    log.info('Watching %s for new files...', args.path)
+    try:
+        while True:
+            for name, changed in watcher.wait(1 if len(pending) > 0 else None):
+                if not is_folder_entry(name):
+                    continue
+                if changed:
+                    pending[name] = time.time()
+                    deleted.discard(name)
+                else:
+                    pending.pop(name, None)
+                    deleted.add(name)
+
+            if len(deleted) > 0:
+                if args.watch_remove:
+                    remove_folder_entries(args, [os.path.join(args.path, n) for n in sorted(deleted)])
+                deleted.clear()
+
+            # files still being copied keep getting events
+            now = time.time()
+            ready = [n for n, t in pending.items() if now - t >= args.watch_debounce]
+            for n in ready:
+                del pending[n]
+            files = [os.path.join(args.path, n) for n in sorted(ready) if os.path.isfile(os.path.join(args.path, n))]
+            if len(files) == 0:
+                continue
+
+            for f in scrape_files(mod, args, files):
+                # retried on the next round
+                pending[os.path.basename(f)] = time.time()
+            if args.db_only:
+                # regenerate the gamelist from the store
+                export_gamelist(args, args.path)
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def iter_dat_roms(path):
+    """
+    stream the roms of a DAT file (logiqx xml or clrmamepro)
+    :param path: path to the DAT file
+    :return: generator of (game name, size, crc32)
+    """
+    with open(path, 'rb') as f:
+        xml = f.read(1024).lstrip().startswith(b'<')
+
+    if xml:
+        from lxml import etree
+
+        for _, game in etree.iterparse(path, tag=('game', 'machine')):
+            for rom in game.iter('rom'):
+                if rom.get('crc') is not None and rom.get('size') is not None:
+                    yield game.get('name'), int(rom.get('size')), int(rom.get('crc'), 16)
+
+            # free parsed entries (and the emptied ones kept by the root)
+            game.clear()
+            while game.getprevious() is not None:
+                del game.getparent()[0]
+        return
+
+    game = re.compile(r'^\s*game\s*\(\s*$|^\s*name\s+"([^"]*)"')
+    rom = re.compile(r'^\s*rom\s*\(.*\bsize\s+([0-9]+).*\bcrc\s+([0-9a-fA-F]{8})')
+    name = None
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for l in f:
+            m = game.match(l)
+            if m is not None:
+                if m.group(1) is None:
+                    # a new game, its name follows
+                    name = ''
+                elif name == '':
+                    name = m.group(1)
+                continue
+            m = rom.match(l)
+            if m is not None and name:
+                yield name, int(m.group(1)), int(m.group(2), 16)
+
+
+def import_dats(args):
+    """
+    add the roms of the '--import_dat' files to the crc index of the store, by title (for any engine)
+    """
+    store = vscraper_db.open_store(args.db)
+    for path in args.import_dat:
+        rows = [('', crc, size, vscraper_names.parse_filename(name)['name'], None)
+                for name, size, crc in iter_dat_roms(path)]
+        store.put_crcs(rows)
+        log.info('Imported %d roms from %s', len(rows), path)
+
+
+def export_gamelist(args, folder):
+    """
+    export gamelist xml for a folder from the store
+    :param args: dictionary
+    :param folder: the folder
+    :return:
+    """
+    store = vscraper_db.open_store(args.db)
+    gamelist_path = args.gamelist_path
+    if gamelist_path is None:
+        gamelist_path = os.path.join(folder, 'gamelist.xml')
+
+    log.info('Writing XML: %s', gamelist_path)
+    count = write_game_entries(gamelist_path, store.iter_games(folder))
+    log.info('done, exported %d entries to %s !', count, gamelist_path)
+
+
+def export_gamelists(args):
+    """
+    export gamelist xml for '--path' folder, or for every folder in the store
+    """
+    if args.path is not None:
+        export_gamelist(args, os.path.abspath(args.path))
+        return
+
+    # every folder gets its own gamelist
+    args.gamelist_path = None
+    for folder in vscraper_db.open_store(args.db).folders():
+        export_gamelist(args, folder)
+
+
+def iter_gamelist_nodes(path):
+    """
+    stream the nodes of a gamelist xml: the root element when it starts (its children are not there yet), each of
+    its children (<game>, <folder>, <provider>, comments, ...) once complete and freed after use, the root again when
+    it ends, and the comments/processing instructions outside the root
+    :param path: path to gamelist.xml
+    :return: generator of (kind, node), kind is 'root', 'child', 'end' or 'outer'
+    """
+    from lxml import etree
+
+    depth = 0
+    for event, node in etree.iterparse(path, events=('start', 'end', 'comment', 'pi')):
+        if event == 'start':
+            if depth == 0:
+                yield 'root', node
+            depth += 1
+            continue
+
+        if event == 'end':
+            depth -= 1
+            if depth == 0:
+                yield 'end', node
+                continue
+        elif depth == 0:
+            yield 'outer', node
+            continue
+
+        if depth == 1:
+            yield 'child', node
+
+            # free parsed entries
+            if isinstance(node.tag, str):
+                node.clear(keep_tail=True)
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+
+class GamelistWriter:
+    """
+    write a gamelist xml node by node, as streamed by iter_gamelist_nodes() (attributes, comments and such included)
+    :param f: text file opened for writing
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._end_tag = ''
+
+    def write(self, kind, node):
+        """
+        write a node
+        :param kind: the kind of node, as in iter_gamelist_nodes()
+        :param node: the node
+        :return:
+        """
+        from lxml import etree
+
+        if kind == 'root':
+            # the start tag only, the end tag is written at the end
+            shell = etree.Element(node.tag, dict(node.attrib), nsmap=node.nsmap)
+            shell.text = '\n'
+            tags = etree.tostring(shell, encoding='unicode')
+            self._f.write(tags[:tags.rindex('</')])
+            self._end_tag = tags[tags.rindex('</'):]
+        elif kind == 'end':
+            self._f.write(self._end_tag + '\n')
+        else:
+            node.tail = None
+            self._f.write('%s%s\n' % ('  ' if kind == 'child' else '', etree.tostring(node, encoding='unicode')))
+
+    def write_xml(self, xml):
+        """
+        write a child of the root, already serialized
+        :param xml: the child
+        :return:
+        """
+        self._f.write('  %s\n' % xml)
+
+
+def drop_game_entries(path, tmp_path, matcher):
+    """
+    stream a gamelist xml to another file, without the entries whose path matches (anything else is copied as is)
+    :param path: path to gamelist.xml
+    :param tmp_path: path to the output file
+    :param matcher: compiled regex (or vscraper_utils.PatternSet)
+    :return: [(path, name)] of the dropped entries
+    """
+    removed = []
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        writer = GamelistWriter(f)
+        for kind, node in iter_gamelist_nodes(path):
+            if kind == 'child' and node.tag == 'game':
+                p = node.findtext('path')
+                if p is not None and matcher.match(p):
+                    removed.append((p, node.findtext('name')))
+                    continue
+            writer.write(kind, node)
+    return removed
+
+
+def delete_entries(args):
+    """
+    delete one or more entries for gamelist xml, if they matches any of the specified regexes
+    """
+    if not os.path.exists(args.gamelist_path):
+        log.error('%s not found!', args.gamelist_path)
+        return
+
+    # the patterns are compiled once, then matched in order
+    patterns = list(args.purge)
+    if args.purge_file is not None:
+        patterns += vscraper_utils.read_patterns(args.purge_file)
+    if len(patterns) == 0:
+        log.info('No patterns to purge!')
+        return
+    matcher = vscraper_utils.compile_patterns(patterns, re.M | re.I)
+
+    # single pass on the xml, streaming the entries to keep to a temporary
+    tmp_path = '%s.tmp' % args.gamelist_path
+    removed = drop_game_entries(args.gamelist_path, tmp_path, matcher)
+
+    if len(removed) == 0 or args.purge_test:
+        os.remove(tmp_path)
+        if len(removed) == 0:
+            log.info('Nothing to delete!')
+            return
+
+    for path, name in removed:
+        log.info('%s: %s (%s)', 'matching' if args.purge_test else 'removing', path, name)
 
-        normalized = re.sub('[^0-9a-zA-Z]+', '-', game_info['name'])
-        img_path = os.path.join(args.img_path, '%s.png' % normalized)
-        vscraper_utils.write_to_file(img_path, game_info['img_buffer'])
+    if args.purge_test:
+        log.info('done, %d entries would be removed from %s !', len(removed), args.gamelist_path)
+        return
 
-        # add path to dictionary
-        game_info['image'] = img_path
-    else:
-        game_info['image'] = None
+    # rewrite
+    log.info('Writing XML: %s', args.gamelist_path)
+    os.replace(tmp_path, args.gamelist_path)
 
-    # add title path to dictionary
-    game_info['path'] = args.path
+    # keep the store in sync, if any
+    if args.db is None:
+        args.db = os.path.join(os.path.dirname(os.path.abspath(args.gamelist_path)), vscraper_db.DB_NAME)
+    if os.path.exists(args.db):
+        vscraper_db.open_store(args.db).delete_games([path for path, _ in removed])
 
-    # create xml
-    if os.path.exists(args.gamelist_path):
-        # read existing
-        xml = objectify.fromstring(
-            vscraper_utils.read_from_file(args.gamelist_path))
-    else:
-        # create new
-        xml = objectify.Element('gameList')
+    # also try to delete the files
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        deleted = sum(pool.map(vscraper_utils.remove_file, [path for path, _ in removed]))
 
-    # add entry
-    if args.append_auto == 0:
-        # single entry
-        add_game_entry(args, xml, game_info)
-    else:
-        # add multiple entries
-        idx = 1
-        base_name = game_info['name']
-        base_path = game_info['path']
-        for idx in range(1, args.append_auto + 1):
-            idx_str = str(idx)
-            # generates a new path
-            ext = os.path.splitext(base_path)[1]
-            path_no_ext = os.path.splitext(base_path)[0]
-            if idx < 10:
-                dsk_path = path_no_ext[:-1] + idx_str
-            else:
-                dsk_path = path_no_ext[:-2] + idx_str
+    log.info('done, removed %d entries (%d files deleted) from %s !', len(removed), deleted, args.gamelist_path)
 
-            new_path = dsk_path + ext
-            game_info['path'] = new_path
 
-            # generates a new name
-            name = base_name
-            name += (' (disk %s)' % idx_str)
-            game_info['name'] = name
+def iter_game_entries(path):
+    """
+    stream the entries of a gamelist xml
+    :param path: path to gamelist.xml
+    :return: generator of dictionaries { tag: text } (layout as in add_game_entry(), plus any other child)
+    """
+    from lxml import etree
 
-            # add entry
-            add_game_entry(args, xml, game_info)
+    for _, game in etree.iterparse(path, tag='game'):
+        entry = {}
+        for f in GAME_FIELDS:
+            v = game.findtext(f)
+            if v is not None:
+                entry[f] = v
+        for c in game:
+            if isinstance(c.tag, str) and c.tag not in entry:
+                entry[c.tag] = c.text
 
-    # rewrite
-    print('Writing XML: %s' % args.gamelist_path)
-    objectify.deannotate(xml)
-    etree.cleanup_namespaces(xml)
-    s = etree.tostring(xml, pretty_print=True)
-    vscraper_utils.write_to_file(args.gamelist_path, s)
+        # free parsed entries
+        game.clear()
+        while game.getprevious() is not None:
+            del game.getparent()[0]
 
-    print('Successfully processed "%s": %s (%s)' %
-          (args.to_search, game_info['name'], args.path))
-    if args.debug:
-        # print debug result, avoid to print the image buffer if any
-        if game_info['img_buffer'] is not None:
-            game_info['img_buffer'] = '...'
+        yield entry
 
-        print(game_info)
 
-    return 0
+def get_gamelist_index(path):
+    """
+    get the names of the entries of a gamelist xml by path, parsing it again only if changed on disk
+    :param path: path to gamelist.xml
+    :return: { path: name }
+    """
+    st = os.stat(path)
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _gamelist_indexes.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, {e.get('path'): e.get('name', '') for e in iter_game_entries(path)})
+        _gamelist_indexes[path] = cached
+    return cached[1]
 
 
-def scrape_folder(mod, args):
+def game_entry_key(entry):
     """
-    scrape an entire folder, based on filenames
+    get the key to join entries of different gamelists
+    :param entry: an entry as returned by iter_game_entries()
+    :return: the normalized path, or None
     """
+    if entry.get('path') is None:
+        return None
+    return os.path.normcase(os.path.normpath(entry['path']))
 
-    # get all files in folder
-    args.path = os.path.abspath(args.path)
-    files = os.listdir(args.path)
-    tmp = args.path
-    args.path_is_dir = True
-    for f in files:
-        if os.path.isdir(os.path.join(tmp, f)):
-            # skip subfolders
-            continue
-        if f.lower() == 'gamelist.xml':
-            # skip gamelist
-            continue
 
-        try:
-            # process entry
-            game_path = os.path.join(tmp, f)
-            args.path = game_path
-            args.to_search = None
-            res = scrape_title(mod, args)
-            if res == 0 or res == -3:
-                # sleep between 1 and sleep (avoid hammering)
-                seconds = random.randint(1, int(args.sleep))
-                time.sleep(seconds)
+def absolute_entry_paths(entries, folder):
+    """
+    make the paths of gamelist entries absolute, as the store keeps them
+    :param entries: iterable of dictionaries { tag: text }
+    :param folder: the folder relative paths are relative to (the gamelist folder)
+    :return: generator of dictionaries { tag: text }
+    """
+    for entry in entries:
+        for tag in ('path', 'image', 'thumbnail'):
+            if entry.get(tag):
+                entry[tag] = os.path.abspath(os.path.join(folder, entry[tag]))
+        yield entry
 
-        except Exception as e:
-            # show error and continue
-            traceback.print_exc()
-            continue
 
-    # done
-    args.path = tmp
+def write_game_entries(path, entries):
+    """
+    stream entries to a gamelist xml
+    :param path: path to gamelist.xml (will be overwritten)
+    :param entries: iterable of dictionaries { tag: text }
+    :return: number of written entries
+    """
+    from lxml import etree
 
+    count = 0
+    tmp_path = '%s.tmp' % path
+    with etree.xmlfile(tmp_path, encoding='utf-8') as xf:
+        with xf.element('gameList'):
+            for entry in entries:
+                game = etree.Element('game')
+                for f in GAME_FIELDS:
+                    if entry.get(f) is not None:
+                        etree.SubElement(game, f).text = entry[f]
+                for f, v in entry.items():
+                    if f not in GAME_FIELDS and v is not None:
+                        etree.SubElement(game, f).text = v
+                etree.indent(game, space='  ', level=1)
+                xf.write('\n  ', game)
+                count += 1
+            xf.write('\n')
+
+    os.replace(tmp_path, path)
+    return count
+
+
+def merge_game_nodes(old_xml, node):
+    """
+    merge the non-empty children (and the attributes) of an entry into another one
+    :param old_xml: the entry to merge into, serialized
+    :param node: the entry whose non-empty children win
+    :return: the merged entry, serialized
+    """
+    from lxml import etree
 
-def delete_entries(args):
+    merged = etree.fromstring(old_xml)
+    merged.attrib.update(node.attrib)
+    for c in node:
+        if not isinstance(c.tag, str) or c.text is None or c.text.strip() == '' or c.text == '-':
+            continue
+        c = copy.deepcopy(c)
+        old = merged.find(c.tag)
+        if old is None:
+            merged.append(c)
+        else:
+            merged.replace(old, c)
+    etree.indent(merged, space='  ', level=1)
+    return etree.tostring(merged, encoding='unicode')
+
+
+def merge_gamelists(args):
     """
-    delete one or more entries for gamelist xml, if they matches the specified regex
+    merge gamelist xmls into '--gamelist_path', joining entries (<game>, <folder>) on their path. any other node
+    (i.e. <provider>, comments) is kept once. entries are spilled to a temporary sqlite table, so memory does not
+    grow with the gamelists size
     """
-    if not os.path.exists(args.gamelist_path):
-        print('%s not found!' % args.gamelist_path)
-        return
+    import sqlite3
+    import tempfile
+    from lxml import etree
+
+    sources = []
+    for p in args.merge:
+        if not os.path.exists(p):
+            log.error('%s not found!', p)
+            return
+        sources.append(p)
+
+    # sources are applied oldest first, so newer ones win. the preferred one, if any, is applied last
+    sources.sort(key=os.path.getmtime)
+    if args.merge_policy == 'prefer':
+        preferred = args.merge[args.merge_prefer - 1]
+        sources.remove(preferred)
+        sources.append(preferred)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # key -> (first seen order, is a game, serialized node)
+        conn = sqlite3.connect(os.path.join(tmp, 'merge.db'))
+        conn.execute('CREATE TABLE nodes (key TEXT PRIMARY KEY, seq INTEGER, game INTEGER, xml TEXT)')
+        seq = 0
+        root_attrib = {}
+        for src in sources:
+            count = 0
+            for kind, node in iter_gamelist_nodes(src):
+                if kind == 'root':
+                    root_attrib.update(node.attrib)
+                    continue
+                if kind != 'child':
+                    continue
+
+                node.tail = None
+                xml = etree.tostring(node, encoding='unicode')
+                path = node.findtext('path') if isinstance(node.tag, str) else None
+                if path is None:
+                    # kept once, whatever the indentation
+                    digest = hashlib.sha1(re.sub(r'>\s+<', '><', xml).strip().encode('utf-8')).hexdigest()
+                    conn.execute('INSERT OR IGNORE INTO nodes VALUES (?,?,0,?)', ('\0' + digest, seq, xml))
+                    seq += 1
+                    continue
+
+                count += node.tag == 'game'
+                key = '%s\0%s' % (node.tag, os.path.normcase(os.path.normpath(path)))
+                row = conn.execute('SELECT xml FROM nodes WHERE key=?', (key,)).fetchone()
+                if row is None:
+                    conn.execute('INSERT INTO nodes VALUES (?,?,?,?)', (key, seq, node.tag == 'game', xml))
+                    seq += 1
+                    continue
+
+                if args.merge_policy != 'non_empty':
+                    # the whole entry wins
+                    conn.execute('UPDATE nodes SET xml=? WHERE key=?', (xml, key))
+                else:
+                    # only non-empty fields win
+                    conn.execute('UPDATE nodes SET xml=? WHERE key=?', (merge_game_nodes(row[0], node), key))
+            conn.commit()
+            log.info('Read %d entries from %s', count, src)
+
+        log.info('Writing XML: %s', args.gamelist_path)
+        count = 0
+        tmp_path = '%s.tmp' % args.gamelist_path
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            writer = GamelistWriter(f)
+            writer.write('root', etree.Element('gameList', root_attrib))
+            for game, xml in conn.execute('SELECT game, xml FROM nodes ORDER BY seq'):
+                writer.write_xml(xml)
+                count += game
+            writer.write('end', None)
+        conn.close()
+        os.replace(tmp_path, args.gamelist_path)
+
+    log.info('done, merged %d gamelists to %d entries in %s !', len(sources), count, args.gamelist_path)
+
+
+def diff_gamelists(args):
+    """
+    report the entries added, removed and changed between two gamelist xmls
+    """
+    old_path, new_path = args.diff
+    for p in args.diff:
+        if not os.path.exists(p):
+            log.error('%s not found!', p)
+            return
+
+    # only names and fields hashes of the old entries are kept
+    index = {}
+    for entry in iter_game_entries(old_path):
+        key = game_entry_key(entry)
+        if key is not None:
+            index[key] = (entry['path'], entry.get('name'), {f: hash(v) for f, v in entry.items()})
+
+    added = 0
+    changed = 0
+    for entry in iter_game_entries(new_path):
+        key = game_entry_key(entry)
+        if key is None:
+            continue
+        old = index.pop(key, None)
+        if old is None:
+            added += 1
+            log.info('+ %s (%s)', entry['path'], entry.get('name'))
+            continue
 
-    # read xml
-    xml = objectify.fromstring(vscraper_utils.read_from_file(args.gamelist_path))
-    modified = 0
-    for game in xml.getchildren():
-        for e in game.getchildren():
-            if e.tag == 'path':
-                match = re.match(args.purge, e.text, re.M | re.I)
-                if match:
-                    print('removing: %s (%s)' % (e.text, game.getchildren()[0]))
-                    xml.remove(game)
-
-                    # also try to delete file
-                    try:
-                        os.remove(e.text)
-                    except Exception as e:
-                        pass
-                    modified = 1
-
-    if modified == 0:
-        print('Nothing to delete!')
-        return
+        hashes = old[2]
+        fields = [f for f in set(hashes) | set(entry) if hashes.get(f) != (hash(entry[f]) if f in entry else None)]
+        if len(fields) > 0:
+            changed += 1
+            log.info('~ %s (%s): %s', entry['path'], entry.get('name'), ','.join(sorted(fields)))
 
-    # rewrite
-    print('Writing XML: %s' % args.gamelist_path)
-    objectify.deannotate(xml)
-    etree.cleanup_namespaces(xml)
-    s = etree.tostring(xml, pretty_print=True)
-    vscraper_utils.write_to_file(args.gamelist_path, s)
+    for old in index.values():
+        log.info('- %s (%s)', old[0], old[1])
+
+    log.info('done, %d added, %d removed, %d changed !', added, len(index), changed)
 
 
 def preprocess_duplicates_internal_move_delete_file(args, entry):
     """
     move or delete the file during duplicates preprocessing
     """
+    src_path = os.path.join(args.path, entry)
     if args.dumpbin is not None:
         # move
         moved_path = os.path.join(args.dumpbin, entry)
-        src_path = os.path.join(args.path, entry)
-        print('MOVING DUPLICATE: %s to %s\n' % (src_path, moved_path))
+        log.info('MOVING DUPLICATE: %s to %s', src_path, moved_path)
         if not args.preprocess_test:
             # actually move the file there
             shutil.move(src_path, moved_path)
     else:
         # delete
-        print('DELETING DUPLICATE: %s\n' % src_path)
+        log.info('DELETING DUPLICATE: %s', src_path)
         if not args.preprocess_test:
             # actually delete the file
             os.unlink(src_path)
@@ -434,6 +1585,8 @@ def preprocess_duplicates_internal(args, entry, files):
     :param files the whole list
     :return: the processed list
     """
+    from fuzzywuzzy import fuzz
+
     l = []
 
     # add the main entry
@@ -533,72 +1686,243 @@ def preprocess_duplicates(args):
             files = preprocess_duplicates_internal(args, f, files)
         except Exception as e:
             # show error and continue
-            traceback.print_exc()
+            log.exception('Error processing "%s"', f)
             continue
 
-    print('done, processed %d files, cleaned up to %d in %s !' %
-          (init_count, len(files), args.path))
+    log.info('done, processed %d files, cleaned up to %d in %s !', init_count, len(files), args.path)
 
 
 def preprocess(args):
     """
-    preprocess folder to delete unneeded files
+    preprocess folder to delete unneeded files, or sort them into buckets, following ordered rules
     """
     args.path = os.path.abspath(args.path)
 
-    if args.dumpbin is not None:
-        if args.preprocess_test is not True:
-            # create the move-to path
-            os.makedirs(args.dumpbin, mode=0o777, exist_ok=True)
+    # the first matching rule wins, files matching no rule are excluded
+    rules = []
+    if args.preprocess_rules is not None:
+        rules += vscraper_utils.read_rules(args.preprocess_rules)
+    if args.preprocess != '':
+        rules.append(('include', None, args.preprocess))
+    if len(rules) == 0:
+        log.info('No rules to preprocess!')
+        return
+    matcher = vscraper_utils.compile_rules(rules, re.I)
+
+    # classify in a single pass, collecting the moves (to a folder) and deletes (to None)
+    ops = []
+    kept = 0
+    with os.scandir(args.path) as it:
+        for e in it:
+            if not e.is_file():
+                # skip subfolders
+                continue
+
+            if e.name.lower() == 'gamelist.xml' or e.name.startswith(vscraper_db.DB_NAME):
+                # skip gamelist and store
+                continue
+
+            idx = matcher.match_index(e.name)
+            action, bucket, _ = rules[idx] if idx >= 0 else ('exclude', None, None)
+            if action == 'include':
+                kept += 1
+                continue
+
+            if action == 'move':
+                folder = os.path.join(args.dumpbin if args.dumpbin is not None else args.path, bucket)
+            else:
+                folder = args.dumpbin
+            ops.append((e.path, folder))
+            log.debug('%s, %s', e.path, 'deleting' if folder is None else 'moving to %s' % folder)
+
+    # per destination summary
+    summary = {}
+    for _, folder in ops:
+        summary[folder] = summary.get(folder, 0) + 1
+
+    failed = 0
+    if args.preprocess_test is not True and len(ops) > 0:
+        for folder in summary:
+            if folder is not None:
+                # create the move-to paths
+                os.makedirs(folder, mode=0o777, exist_ok=True)
+
+        def _apply(op):
+            if op[1] is None:
+                return vscraper_utils.remove_file(op[0])
+            return vscraper_utils.move_file(op[0], os.path.join(op[1], os.path.basename(op[0])))
+
+        # file operations are I/O bound, run them in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            failed = len(ops) - sum(pool.map(_apply, ops))
+
+    log.info('%s, %d files kept', args.path, kept)
+    for folder, n in sorted(summary.items(), key=lambda i: '' if i[0] is None else i[0]):
+        if folder is None:
+            log.info('%d files %s', n, 'to be deleted' if args.preprocess_test else 'deleted')
+        else:
+            log.info('%d files %s %s', n, 'to be moved to' if args.preprocess_test else 'moved to', folder)
+    if failed > 0:
+        log.error('%d files could not be moved/deleted!', failed)
 
-    # get all files in folder
-    files = os.listdir(args.path)
-    tmp = args.path
-    args.path_is_dir = True
-    count = 0
-    tot = 0
-    for f in files:
-        if os.path.isdir(f):
-            # skip subfolders
-            continue
+    log.info('done, moved/deleted %d files (out of %d) in %s !', len(ops) - failed, kept + len(ops), args.path)
 
-        if f.lower() == 'gamelist.xml':
-            # skip gamelist
-            continue
+
+class _JobOutput(io.TextIOBase):
+    """
+    streams a job output to the http client
+    """
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if not self._closed:
+            try:
+                self._wfile.write(s.encode('utf-8'))
+                self._wfile.flush()
+            except OSError:
+                # client gone, the job runs to completion anyway
+                self._closed = True
+        return len(s)
+
+
+# job options taking paths, which must be inside the '--serve_root' folders
+_JOB_PATH_OPTIONS = ['path', 'gamelist_path', 'db', 'img_path', 'dumpbin', 'merge', 'diff', 'catalog_path',
+                     'purge_file', 'preprocess_rules', 'import_dat', 'log_jsonl']
+
+
+def _is_inside(path, roots):
+    """
+    check if a path is inside one of the given folders
+    :param path: the path (absolute, symlinks resolved)
+    :param roots: [folder] (absolute, symlinks resolved)
+    :return: bool
+    """
+    return any(os.path.commonpath([root, path]) == root for root in roots)
+
+
+class _JobHandler(http.server.BaseHTTPRequestHandler):
+    """
+    runs the jobs posted to /jobs
+    """
+
+    # one job at a time, they share the process state (cwd, stdout, connection pools)
+    lock = threading.Lock()
+
+    # set by serve(): the token expected as 'Authorization: Bearer <token>', and the folders jobs may touch
+    token = None
+    roots = []
+
+    def _send_text(self, code, text):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self.send_error(404)
+            return
+
+        if not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'),
+                                   ('Bearer %s' % _JobHandler.token).encode('utf-8')):
+            self.send_error(401, 'missing or wrong token')
+            return
 
         try:
-            # process entry
-            match = re.match(args.preprocess, f, re.I)
-            game_path = os.path.join(tmp, f)
-            tot += 1
-            if match is not None:
-                print('MATCHING, %s' % game_path)
-            else:
-                # not MATCHING
-                if args.dumpbin:
-                    renamed = os.path.join(args.dumpbin, f)
-                    count += 1
-                    if args.preprocess_test is not True:
-                        # rename/move
-                        shutil.move(game_path, renamed)
-                    print('NOT MATCHING, %s, moved to %s' % (game_path,
-                                                             renamed))
-                else:
-                    print('NOT MATCHING, %s, deleting' % (game_path))
-                    count += 1
-                    if args.preprocess_test is not True:
-                        # delete
-                        os.remove(game_path)
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            argv = [str(a) for a in job['argv']]
+            job_cwd = os.path.realpath(job.get('cwd', os.getcwd()))
         except Exception as e:
-            # show error and continue
-            traceback.print_exc()
-            continue
+            self.send_error(400, 'expected {"argv": [options], "cwd": folder}')
+            return
 
-    print('done, moved/deleted %d files (out of %d) in %s !' % (count, tot,
-                                                                args.path))
+        # parse, catching argparse errors and --help
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+                args = build_parser().parse_args(argv)
+        except SystemExit as e:
+            if e.code in (0, None):
+                self._send_text(200, out.getvalue())
+            else:
+                lines = out.getvalue().strip().splitlines()
+                self.send_error(400, lines[-1] if len(lines) > 0 else 'invalid options')
+            return
+        if args.serve is not None or args.watch is not None or args.preprocess_duplicates is not None:
+            self.send_error(400, '--serve, --watch and --preprocess_duplicates are not allowed in jobs')
+            return
+
+        # jobs move/delete/rewrite files, keep them inside the served folders
+        paths = [job_cwd]
+        for o in _JOB_PATH_OPTIONS:
+            v = getattr(args, o)
+            if isinstance(v, str):
+                paths.append(os.path.realpath(os.path.join(job_cwd, v)))
+            elif isinstance(v, list):
+                paths += [os.path.realpath(os.path.join(job_cwd, p)) for p in v]
+        outside = [p for p in paths if not _is_inside(p, _JobHandler.roots)]
+        if len(outside) > 0:
+            self.send_error(403, '%s is outside the served folders' % outside[0])
+            return
+        if int(args.unattended_timeout) == 0:
+            # nobody to answer
+            args.unattended_timeout = 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        out = _JobOutput(self.wfile)
+        with _JobHandler.lock:
+            cwd = os.getcwd()
+            try:
+                os.chdir(job_cwd)
+                with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+                    res = run_command(args)
+            except Exception as e:
+                out.write('%s\n' % e)
+                res = 1
+            finally:
+                os.chdir(cwd)
+        out.write('exit code: %d\n' % res)
+
+    def log_message(self, format, *args):
+        # not to the job output
+        sys.__stderr__.write('%s - %s\n' % (self.address_string(), format % args))
+
+
+def serve(args):
+    """
+    run the jobs posted over http until interrupted
+    :param args: dictionary
+    :return:
+    """
+    _JobHandler.roots = [os.path.realpath(r) for r in (args.serve_root or [os.getcwd()])]
+    _JobHandler.token = args.serve_token or secrets.token_urlsafe(24)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.serve), _JobHandler)
+    print('Serving jobs on http://127.0.0.1:%d/jobs for %s' % (args.serve, ', '.join(_JobHandler.roots)))
+    if args.serve_token is None:
+        print('Token: %s' % _JobHandler.token)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
-def main():
+def build_parser():
+    """
+    build the command line parser
+    :return: argparse.ArgumentParser
+    """
     parser = argparse.ArgumentParser(
         'Manage games collection and build gamelist.xml by querying online databases\n'
     )
@@ -651,6 +1975,77 @@ def main():
         metavar='SECONDS',
         nargs='?',
         default=15)
+    parser.add_argument(
+        '--workers',
+        help='scrape this many files at once when path refers to a folder (default 1). With more than 1, \'--sleep\' is ignored and requests to each site are paced adaptively',
+        metavar='N',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--requeue',
+        help='when path refers to a folder, retry files failed because the site was unavailable this many more times, after the others (default 3)',
+        metavar='N',
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--max_inflight_mb',
+        help='with \'--workers\', cap the memory held by the images being converted by all the workers at once (default 64). Fetched titles waiting to be written are bounded as well, so memory use does not grow with the folder size',
+        metavar='MB',
+        type=int,
+        default=64)
+    parser.add_argument(
+        '--watch',
+        help='keep watching the folder at \'--path\' and scrape the files added to (or renamed in) it as they appear, into the existing gamelist.xml (existing files are not rescanned)',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--watch_debounce',
+        help='with \'--watch\', scrape a file once it is unchanged for this many seconds, so copies can finish (default 5)',
+        metavar='SECONDS',
+        type=float,
+        default=5)
+    parser.add_argument(
+        '--watch_remove',
+        help='with \'--watch\', also remove the entries of the deleted (or renamed) files from the gamelist',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--normalize',
+        help='before using \'--path\' as search key, strip the TOSEC/No-Intro/GoodTools tags (regions, revisions, disks, dump flags) and move trailing articles (i.e. \'Secret of Monkey Island, The (1990)(Lucasfilm)(Disk 1 of 4).adf\' searches for \'The Secret of Monkey Island\'). Year and publisher tags are used to choose among multiple titles found. Ignored if \'--trunc_at\' is specified',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--variants',
+        help='when a title is not found, retry with variants of the query (without subtitle, roman/arabic numerals swapped, leading article moved or dropped, without punctuation) before giving up. The variant found is remembered in the store for the next time',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--variants_budget',
+        help='with \'--variants\', stop trying variants of a title after this many search requests (the game page and images of the variant found are not counted, default 6)',
+        metavar='N',
+        type=int,
+        default=6)
+    parser.add_argument(
+        '--search_cache_days',
+        help='engines supporting it (gamesdatabase-misc) keep the parsed search results in %s for this many days, to serve every system from a single search (default 30, 0 to disable)' % vscraper_db.CACHE_PATH,
+        metavar='DAYS',
+        type=float,
+        default=30)
+    parser.add_argument(
+        '--archive_names',
+        help='for .zip (and .7z, if py7zr is installed) files, search for the name of the file inside the archive when more descriptive than the archive name (only the archive directory is read, nothing is extracted)',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--crc',
+        help='for .zip (and .7z, if py7zr is installed) files, look up the crc32 and size of the file inside in the store crc index before searching: a known url is downloaded directly, a known title is searched for. Successful scrapes are added to the index',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--import_dat',
+        help='add the roms of the given DAT files (logiqx xml or clrmamepro) to the crc index of the store at \'--db\' (or \'<path>/.es-vscraper.db\'), to be used with \'--crc\'',
+        metavar='PATH',
+        nargs='+')
     parser.add_argument(
         '--trunc_at',
         help='before using \'--path\' as search key, truncate at the first occurrence of any of the given characters (i.e. --path \'./caesar the cat, (demo) (eng).zip\' --trunc_at \'(,\' searches for \'caesar the cat\')',
@@ -665,6 +2060,31 @@ def main():
         help='existing entries in gamelist.xml will be overwritten. Default is to skip existing entries',
         action='store_const',
         const=True)
+    parser.add_argument(
+        '--revalidate',
+        help='with \'--overwrite\', existing entries are kept (skipping their download) if their source page is unchanged on the server',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--db',
+        help='path to the local store keeping source urls and such (default \'<gamelist_path folder>/%s\')' % vscraper_db.DB_NAME,
+        metavar='PATH',
+        nargs='?')
+    parser.add_argument(
+        '--db_only',
+        help='update the local store only, gamelist.xml is regenerated at the end of a folder scraping or with \'--export\'',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--export',
+        help='export gamelist.xml from the local store at \'--db\' for the \'--path\' folder (default every folder in the store, anything else is ignored)',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--fields',
+        help='only get these fields, as csv (%s, default all). Existing entries keep the values of the other fields, and engines supporting it skip the requests for them (i.e. --fields name,publisher,releasedate,genre)' % ','.join(vscraper_utils.FIELDS),
+        metavar='FIELDS',
+        type=lambda v: ['name'] + [f for f in v.split(',') if f != 'name'])
     parser.add_argument(
         '--img_path',
         help='path to the folder where to store images (default \'<path>/images)\'',
@@ -680,6 +2100,22 @@ def main():
         help='download image thumbnail (support depends on the scraper engine)',
         action='store_const',
         const=True)
+    parser.add_argument(
+        '--img_variants',
+        help='also store downscaled variants of each image, as a csv of sizes in pixels of the longest side (i.e. 640,320), next to it as \'<image>_<size>.png\'. The image is decoded once and downscaled progressively',
+        metavar='SIZES',
+        type=lambda v: [int(s) for s in v.split(',')])
+    parser.add_argument(
+        '--img_image_size',
+        help='the \'--img_variants\' size to use as <image> (default 0, the full size image)',
+        metavar='SIZE',
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--img_thumbnail_size',
+        help='the \'--img_variants\' size to use as <thumbnail> (0 for the full size image), if specified',
+        metavar='SIZE',
+        type=int)
     parser.add_argument(
         '--append',
         help='append this string (enclosed in \'\' if containing spaces) to the game name in the gamelist.xml file. Only valid if \'--path\' do not refer to a folder',
@@ -704,14 +2140,55 @@ def main():
         nargs='?')
     parser.add_argument(
         '--purge',
-        help='delete all the entries whose path matches the given regex from the gamelist.xml (needs \'--gamelist_path\', anything else is ignored). This also deletes the affected game files!',
+        help='delete all the entries whose path matches any of the given regexes from the gamelist.xml (needs \'--gamelist_path\', anything else is ignored). This also deletes the affected game files!',
         metavar='REGEX',
+        nargs='*')
+    parser.add_argument(
+        '--purge_file',
+        help='like \'--purge\', with the regexes read from a file (one per line, lines starting with # are ignored)',
+        metavar='PATH',
         nargs='?')
+    parser.add_argument(
+        '--purge_test',
+        help='test for \'--purge\', only report the matching entries',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--merge',
+        help='merge the given gamelist.xml files into \'--gamelist_path\', joining entries on their path',
+        metavar='PATH',
+        nargs='+')
+    parser.add_argument(
+        '--merge_policy',
+        help='on conflicts with \'--merge\', the entry from the newest file wins (newest, default), the newest non-empty fields win (non_empty), or the file at \'--merge_prefer\' wins (prefer)',
+        choices=['newest', 'non_empty', 'prefer'],
+        default='newest')
+    parser.add_argument(
+        '--merge_prefer',
+        help='1-based index of the preferred \'--merge\' file, for \'--merge_policy prefer\'',
+        metavar='N',
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--diff',
+        help='report the entries added, removed and changed from the first gamelist.xml to the second (anything else is ignored)',
+        metavar='PATH',
+        nargs=2)
+    parser.add_argument(
+        '--img_gc',
+        help='delete the stored images at \'--img_path\' (or \'<gamelist_path folder>/images\') not referenced anymore by the <image>/<thumbnail> of any entry of the gamelist at \'--gamelist_path\' and/or the store at \'--db\' (or \'<gamelist_path folder>/.es-vscraper.db\'), then the blobs they were stored as. Use \'--preprocess_test\' to only report',
+        action='store_const',
+        const=True)
     parser.add_argument(
         '--preprocess',
         help='preprocess folder at \'--path\' and keep only the files matching the given regex (every other parameter is ignored). This cleans the directory for later processing by the scraper',
         metavar='REGEX',
         nargs='?')
+    parser.add_argument(
+        '--preprocess_rules',
+        help='like \'--preprocess\', with ordered rules read from a file, one per line: \'include REGEX\', \'exclude REGEX\' (moved to \'--dumpbin\' if specified, or deleted) or \'move BUCKET REGEX\' (moved to the BUCKET folder, inside \'--dumpbin\' if specified or else \'--path\'). The first matching rule wins, files matching no rule are excluded (lines starting with # are ignored)',
+        metavar='PATH',
+        nargs='?')
     parser.add_argument(
         '--preprocess_duplicates',
         help='check for duplicates (and ask for deletion or moving to \'--dumpbin\' if specified)',
@@ -722,18 +2199,88 @@ def main():
         help='test for preprocessing options, do not delete/move files',
         action='store_const',
         const=True)
+    parser.add_argument(
+        '--build_catalog',
+        help='crawl the engine listing pages (throttled by \'--sleep\') into a local catalog of its whole library, to be used with \'--catalog\' (engines able to list their library only, i.e. atariage-atari)',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--catalog',
+        help='resolve titles on the local catalog built with \'--build_catalog\' before searching online',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--catalog_min_score',
+        help='minimum similarity (0-100) for a title to be matched with a catalog entry, when no exact match exists (default 60)',
+        metavar='SCORE',
+        type=int,
+        default=60)
+    parser.add_argument(
+        '--catalog_top',
+        help='maximum number of catalog entries to choose from, when no exact match exists (default 5)',
+        metavar='N',
+        type=int,
+        default=5)
+    parser.add_argument(
+        '--catalog_path',
+        help='path to the folder where to store catalogs (default \'./%s\' in the es-vscraper folder)' % vscraper_catalog.CATALOGS_FOLDER,
+        metavar='PATH',
+        nargs='?')
+    parser.add_argument(
+        '--serve',
+        help='keep running, with plugins, connections and caches warm, and run the jobs posted as {"argv": [options], "cwd": folder} to http://127.0.0.1:PORT/jobs (default port 8765) with the \'--serve_token\', streaming back their output. Jobs run one at a time, inside the \'--serve_root\' folders and never wait for input (the first entry is chosen on multiple choices)',
+        metavar='PORT',
+        nargs='?',
+        type=int,
+        const=8765)
+    parser.add_argument(
+        '--serve_token',
+        help='with \'--serve\', the token jobs must send as \'Authorization: Bearer TOKEN\' (default a random one, printed on start)',
+        metavar='TOKEN',
+        nargs='?')
+    parser.add_argument(
+        '--serve_root',
+        help='with \'--serve\', a folder jobs may run in and touch: their \'cwd\' and path options must be inside one of them (can be repeated, default the current folder)',
+        metavar='PATH',
+        action='append')
     parser.add_argument(
         '--debug',
-        help='Print scraping result on the console',
+        help='Print scraping result on the console (same as \'--log_level debug\')',
+        action='store_const',
+        const=True)
+    parser.add_argument(
+        '--log_level',
+        help='the messages to show: debug, info, warning or error (default info)',
+        choices=['debug', 'info', 'warning', 'error'],
+        default='info')
+    parser.add_argument(
+        '--log_jsonl',
+        help='also append the messages to this file, one json record per line (ts, level, thread, msg, and event/path/engine/query/result for the scraped titles)',
+        metavar='PATH')
+    parser.add_argument(
+        '--progress',
+        help='show a live status line (titles/sec and ETA, requests/sec per host, cache hit rate, queue depths) on stderr, or log it every %d seconds when stderr is not a terminal' % (vscraper_log.STATUS_INTERVAL * vscraper_log.STATUS_LOG_EVERY),
         action='store_const',
         const=True)
-    args = parser.parse_args()
+    return parser
+
+
+def run_command(args):
+    """
+    run the command given on the command line (or by a '--serve' job)
+    :param args: parsed arguments from build_parser()
+    :return: exit code
+    """
+    if args.purge_file is not None and args.purge is None:
+        args.purge = []
+    if args.preprocess_rules is not None and args.preprocess is None:
+        args.preprocess = ''
     if args.list_engines:
         # list engines and exit
         scrapers = list_scrapers()
         if len(scrapers) == 0:
             print('No scrapers installed. check ./scrapers folder!')
-            exit(1)
+            return 1
 
         print('Available scrapers:')
         print(
@@ -749,27 +2296,56 @@ def main():
                 '-----------------------------------------------------------------'
             )
 
-        exit(0)
+        return 0
 
     if args.preprocess is not None and args.path is None:
         print('--path is required for --preprocess')
-        exit(1)
+        return 1
     if args.preprocess_duplicates is not None and args.path is None:
         print('--path is required for --preprocess_duplicates')
-        exit(1)
+        return 1
     if args.preprocess is not None and args.preprocess_duplicates is not None:
         print(
             '--preprocess and --preprocess_duplicates are mutually exclusive'
         )
-        exit(1)
+        return 1
     if args.preprocess is None and args.purge is not None and args.gamelist_path is None:
         print('--gamelist_path is required for --purge')
-        exit(1)
-
-    if args.preprocess is None and args.preprocess_duplicates is None and args.purge is None and (
-            args.engine is None or args.path is None):
+        return 1
+    if args.merge is not None and args.gamelist_path is None:
+        print('--gamelist_path is required for --merge')
+        return 1
+    if args.merge_policy == 'prefer' and (args.merge is None or args.merge_prefer < 1 or args.merge_prefer > len(args.merge)):
+        print('--merge_prefer must be the 1-based index of one of the --merge gamelists')
+        return 1
+    if args.export is not None and args.db is None and args.path is None:
+        print('--db or --path is required for --export')
+        return 1
+    if args.watch is not None and (args.path is None or not os.path.isdir(args.path)):
+        print('--path must point to a folder for --watch')
+        return 1
+    if args.fields is not None and any(f not in vscraper_utils.FIELDS for f in args.fields):
+        print('--fields must be a csv of %s' % ','.join(vscraper_utils.FIELDS))
+        return 1
+    for size in (args.img_image_size, args.img_thumbnail_size):
+        if size is not None and size != 0 and (args.img_variants is None or size not in args.img_variants):
+            print('--img_image_size and --img_thumbnail_size must be 0 or one of --img_variants')
+            return 1
+    if args.import_dat is not None and args.db is None and args.path is None:
+        print('--db or --path is required for --import_dat')
+        return 1
+    if args.img_gc is not None and args.img_path is None and args.gamelist_path is None:
+        print('--img_path or --gamelist_path is required for --img_gc')
+        return 1
+
+    if args.preprocess is None and args.preprocess_duplicates is None and args.purge is None and args.img_gc is None and args.merge is None and args.diff is None and args.export is None and args.import_dat is None and (
+            args.engine is None or (args.path is None and args.build_catalog is None)):
         print('--engine and --path are required, use --help for options')
-        exit(1)
+        return 1
+
+    # workers log through a queue, the listener thread writes to the console (and the jsonl sink)
+    vscraper_log.setup('debug' if args.debug else args.log_level, args.log_jsonl,
+                       vscraper_utils.get_host_requests if args.progress else None)
     try:
         if args.preprocess_duplicates is not None:
             preprocess_duplicates(args)
@@ -779,10 +2355,41 @@ def main():
         elif args.purge is not None:
             # delete entries from xml
             delete_entries(args)
+        elif args.img_gc is not None:
+            # delete unreferenced images
+            gc_images(args)
+        elif args.export is not None:
+            # export gamelists from the store
+            if args.db is None:
+                args.db = os.path.join(os.path.abspath(args.path), vscraper_db.DB_NAME)
+            export_gamelists(args)
+        elif args.merge is not None:
+            # merge gamelists
+            merge_gamelists(args)
+        elif args.diff is not None:
+            # compare gamelists
+            diff_gamelists(args)
+        elif args.import_dat is not None:
+            # fill the crc index
+            if args.db is None:
+                args.db = os.path.join(os.path.abspath(args.path), vscraper_db.DB_NAME)
+            import_dats(args)
+        elif args.build_catalog is not None:
+            # crawl the engine
+            mod = get_scraper(args.engine)
+            if not vscraper_catalog.can_build_catalog(mod):
+                log.error('"%s" cannot list its whole library, --build_catalog is not supported', mod.name())
+                return 1
+            build_catalog(mod, args)
         else:
             # get module
             mod = get_scraper(args.engine)
-            if os.path.isdir(args.path) and args.download_url is None:
+            if args.fields is not None and not has_capability(mod, 'fields'):
+                log.info('NOTE: "%s" downloads every field, the ones not in --fields are dropped', mod.name())
+            if args.watch is not None:
+                # scrape new files as they appear
+                watch_folder(mod, args)
+            elif os.path.isdir(args.path) and args.download_url is None:
                 # scrape entire folder
                 scrape_folder(mod, args)
             else:
@@ -791,10 +2398,24 @@ def main():
                 scrape_title(mod, args)
 
     except Exception as e:
-        traceback.print_exc()
-        exit(1)
+        log.exception('Error: %s', e)
+        return 1
+
+    finally:
+        # write what is still queued
+        vscraper_log.shutdown()
+
+    return 0
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.serve is not None:
+        # keep running, jobs are submitted over http
+        serve(args)
+        return 0
+    return run_command(args)
 
 
 if __name__ == "__main__":
-    main()
-    exit(0)
+    exit(main())
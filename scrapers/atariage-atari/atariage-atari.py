@@ -16,13 +16,23 @@ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMA
 OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import collections
 import re
+import threading
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import urllib
+import vscraper_log
 import vscraper_utils
 
+# gallery pages image urls, by (kind, SoftwareID), least recently used first
+_galleries = collections.OrderedDict()
+_galleries_lock = threading.Lock()
+
+# galleries kept, the least recently used are dropped past this (the variants of a cartridge are scraped close
+# to each other, and long --serve/--watch sessions must not keep every gallery ever seen)
+MAX_GALLERIES = 256
+
 
 def _find_a_text_softwareLabelID(tag):
     if tag.name == 'a' and ('SoftwareLabelID' in tag['href']) and (not tag.has_attr('title')):
@@ -44,6 +54,43 @@ def _find_a_text_programmerID(tag):
         return True
     return False
 
+def _get_gallery(soup, kind):
+    """
+    get the image urls of a box/screenshot gallery page, downloaded and parsed once per SoftwareID (shared by the variants of a cartridge)
+    :param soup: the source soup
+    :param kind: 'box' or 'screenshot'
+    :return: [url], may be empty
+    """
+    pages = vscraper_utils.find_href(soup, 'https://atariage.com/%s_page.php?' % kind)
+    if pages is None:
+        return []
+
+    page_url = pages[0]['href']
+    m = re.search('SoftwareID=([0-9]+)', page_url)
+    key = (kind, m.group(1) if m is not None else page_url)
+    with _galleries_lock:
+        img_urls = _galleries.get(key)
+        if img_urls is not None:
+            _galleries.move_to_end(key)
+    vscraper_log.cache_lookup(img_urls is not None)
+    if img_urls is not None:
+        return img_urls
+
+    reply = vscraper_utils.http_get(page_url)
+    if not reply.ok:
+        return []
+
+    # only the images are parsed
+    folder = '/boxes/' if kind == 'box' else '/screenshots/'
+    s = BeautifulSoup(reply.content, 'html.parser', parse_only=SoupStrainer('img', src=True))
+    img_urls = [i['src'] for i in s.find_all('img') if folder in i['src']]
+    with _galleries_lock:
+        _galleries[key] = img_urls
+        while len(_galleries) > MAX_GALLERIES:
+            _galleries.popitem(last=False)
+    return img_urls
+
+
 def _download_image(soup, args):
     """
     download game image
@@ -52,54 +99,42 @@ def _download_image(soup, args):
     :return: image buffer, or None
     """
     img_url = ''
-    got_cover = False
+    img_index = args.img_index
 
-    if args.img_index == -1:
-        # try to get boxart
+    if img_index == -1:
+        # try to get boxart (first)
         try:
-            covers = vscraper_utils.find_href(soup, 'https://atariage.com/box_page.php?')
-            cover_url = covers[0]['href']
-            reply = requests.get(cover_url)
-            html = reply.content
-            s = BeautifulSoup(html, 'html.parser')
-            img_urls = s.find_all('img')
-            for i in img_urls:
-                if '/boxes/' in i['src']:
-                    # found, get first
-                    img_url = i['src']
-                    got_cover = True
-                    break
+            covers = _get_gallery(soup, 'box')
+            if len(covers) > 0:
+                img_url = covers[0]
+        except vscraper_utils.PROPAGATED_EXCEPTIONS:
+            raise
         except Exception as e:
-            # fallback to 0
-            args.img_index = 0
             pass
 
+        if img_url == '':
+            # fallback to 0
+            img_index = 0
+
     try:
-        if not got_cover:
+        if img_url == '':
             # get screenshots
-            scrs = vscraper_utils.find_href(soup, 'https://atariage.com/screenshot_page.php?')
-            scrs_url = scrs[0]['href']
-            reply = requests.get(scrs_url)
-            html = reply.content
-            s = BeautifulSoup(html, 'html.parser')
-            img_urls = s.find_all('img')
-            screens =[]
-            for s in img_urls:
-                if '/screenshots/' in s['src']:
-                    screens.append(s)
+            screens = _get_gallery(soup, 'screenshot')
             try:
-                img_url=screens[args.img_index]['src']
+                img_url = screens[img_index]
             except:
-                img_url=screens[0]['src']
+                img_url = screens[0]
 
         # download
-        reply = requests.get(img_url)
+        reply = vscraper_utils.http_get(img_url)
         img = reply.content
 
         # convert to png
         img_buffer = vscraper_utils.img_to_png(img)
         return img_buffer
 
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except Exception as e:
         return None
 
@@ -109,14 +144,15 @@ def run_direct_url(u, args):
     perform query with the given direct url
     :param u: the game url
     :param args: arguments from cmdline
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
     """
     # issue request
-    reply = requests.get(u)
+    reply = vscraper_utils.http_get(u)
     if not reply.ok:
         raise ConnectionError
 
     game_info = {}
+    game_info['url'] = u
 
     # got game page
     html = reply.content
@@ -161,7 +197,9 @@ def run_direct_url(u, args):
                 game_info['desc'] = body.text.strip()
 
     # image
-    game_info['img_buffer'] = _download_image(soup, args)
+    game_info['img_buffer'] = None
+    if vscraper_utils.wants_field(args, 'image'):
+        game_info['img_buffer'] = _download_image(soup, args)
 
     return game_info
 
@@ -194,36 +232,80 @@ def _check_response(reply):
     return games
 
 
-def run(args):
+def search(args):
     """
-    perform query with the given game title
+    search for the given game title, without downloading the game page
     :param args: arguments from cmdline
     :throws vscraper_utils.GameNotFoundException when a game is not found
-    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: [{ name, publisher, year, url, system}] (each except 'url' may be empty)
     """
     if args.engine_params is None:
-        print(
+        raise ValueError(
             '--engine_params system=... is required (use --list_engines to check supported systems)')
-        raise ValueError
 
     # get system
     engines = {'2600', '5200', '7800', 'lynx', 'jaguar'}
     s = vscraper_utils.get_csv_parameter(args.engine_params, 'system')
     if s not in engines:
-        print('supported systems: %s' % engines)
-        raise ValueError
+        raise ValueError('supported systems: %s' % ', '.join(sorted(engines)))
 
     # get game id
     params = {'searchValue': args.to_search, 'SystemID': s, 'searchType':'NORMAL', 'searchShot':'checkbox', 'searchBox':'checkbox', 'orderBy':'Name'}
     u = 'https://atariage.com/software_list.php'
-    reply = requests.get(u, params=params)
+    reply = vscraper_utils.http_get(u, params=params)
 
     # check response
     if not reply.ok:
         raise ConnectionError
 
-    choices = _check_response(reply)
+    return _check_response(reply)
+
+
+def catalog_pages(args):
+    """
+    list the whole library of the system, page by page (the software list with no search value, following its
+    'currentPage' pages until one brings no new title)
+    :param args: arguments from cmdline
+    :throws vscraper_utils.GameNotFoundException when the system lists no game
+    :return: generator of [{ name, publisher, year, url }], one list per page
+    """
+    if args.engine_params is None:
+        raise ValueError('--engine_params system=... is required (use --list_engines to check supported systems)')
+
+    s = vscraper_utils.get_csv_parameter(args.engine_params, 'system')
+    u = 'https://atariage.com/software_list.php'
+    seen = set()
+    page = 1
+    while True:
+        params = {'searchValue': '', 'SystemID': s, 'searchType': 'NORMAL', 'orderBy': 'Name', 'currentPage': page}
+        reply = vscraper_utils.http_get(u, params=params)
+        if not reply.ok:
+            raise ConnectionError
+
+        try:
+            games = [g for g in _check_response(reply) if g['url'] not in seen]
+        except vscraper_utils.GameNotFoundException:
+            if page == 1:
+                raise
+            games = []
+        if len(games) == 0:
+            # past the last page
+            return
+
+        seen.update(g['url'] for g in games)
+        yield games
+        page += 1
+
+
+def run(args):
+    """
+    perform query with the given game title
+    :param args: arguments from cmdline
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
+    """
+    choices = search(args)
     if len(choices) > 1:
         # return to es-vscraper with a multi choice
         raise vscraper_utils.MultipleChoicesException(choices)
@@ -263,3 +345,11 @@ def engine_help():
     """
     return """system=name: specifies target system ('2600', '5200', '7800', 'lynx', 'jaguar')
         note: thumbnails not available"""
+
+
+def capabilities():
+    """
+    the optional features supported by the plugin
+    :return: [string] ('fields': only the fields in '--fields' are requested)
+    """
+    return ['fields']
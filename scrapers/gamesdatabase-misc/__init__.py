@@ -1 +1 @@
-__all__ = ['run', 'run_direct_url', 'system', 'system_short', 'url', 'name', 'engine_help']
\ No newline at end of file
+__all__ = ['run', 'run_direct_url', 'search', 'system', 'system_short', 'url', 'name', 'engine_help', 'capabilities']
\ No newline at end of file
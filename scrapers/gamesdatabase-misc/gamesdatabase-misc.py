@@ -16,9 +16,12 @@ IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMA
 OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import requests
+import re
+import sqlite3
 from slugify import slugify
 from bs4 import BeautifulSoup
+import vscraper_db
+import vscraper_log
 import vscraper_utils
 
 
@@ -28,98 +31,47 @@ def _find_full_img_tag(tag):
     return False
 
 
-def _find_ingame_thumb_tag(tag):
-    if tag.name == 'img' and tag.has_attr('alt') and tag['alt'].startswith('In game image '):
-        return True
-    return False
-
-
-def _find_title_thumb_tag(tag):
-    if tag.name == 'img' and tag.has_attr('alt') and tag['alt'].startswith('Title screen '):
-        return True
-    return False
-
+# game page thumbnails by alt prefix, and gallery links by text
+THUMB_ALTS = {'In game image ': 'ingame', 'Title screen ': 'title', 'Box cover ': 'box'}
+GALLERY_TEXTS = {'In Game': 'ingame', 'Title Screen': 'title', 'Box': 'box'}
 
-def _find_box_thumb_tag(tag):
-    if tag.name == 'img' and tag.has_attr('alt') and tag['alt'].startswith('Box cover '):
-        return True
-    return False
-
-
-def _find_a_text_box(tag):
-    if tag.name == 'a' and tag.text == 'Box':
-        return True
-    return False
 
-
-def _find_a_text_ingame(tag):
-    if tag.name == 'a' and tag.text == 'In Game':
-        return True
-    return False
-
-
-def _find_a_text_title(tag):
-    if tag.name == 'a' and tag.text == 'Title Screen':
-        return True
-    return False
-
-
-def _download_ingame_image(soup, args):
+def _get_image_tags(soup):
     """
-    download ingame image
-    :param soup: the source soup
-    :param args: arguments from cmdline
-    :return: string
+    collect the image thumbnails and gallery links of the game page, in a single pass
+    :param soup: the game page soup
+    :return: { 'thumbs': { kind: img tag }, 'links': { kind: a tag } }, kind is 'ingame', 'title' or 'box'
     """
-    if args.img_thumbnail:
-        # thumbnail
-        img_url = 'http://www.gamesdatabase.org%s' % soup.find(_find_ingame_thumb_tag)['src']
-    else:
-        # full
-        href = 'http://www.gamesdatabase.org%s' % soup.find(_find_a_text_ingame)['href']
-        reply = requests.get(href)
-        html = reply.content
-        s = BeautifulSoup(html, 'html.parser')
-        img_url = 'http://www.gamesdatabase.org%s' % s.find(_find_full_img_tag)['src']
-
-    return img_url
-
-
-def _download_box_image(soup, args):
-    """
-    download box image
-    :param soup: the source soup
-    :param args: arguments from cmdline
-    :return: string
-    """
-    if args.img_thumbnail:
-        # thumbnail
-        img_url = 'http://www.gamesdatabase.org%s' % soup.find(_find_box_thumb_tag)['src']
-    else:
-        # full
-        href = 'http://www.gamesdatabase.org%s' % soup.find(_find_a_text_box)['href']
-        reply = requests.get(href)
-        html = reply.content
-        s = BeautifulSoup(html, 'html.parser')
-        img_url = 'http://www.gamesdatabase.org%s' % s.find(_find_full_img_tag)['src']
-
-    return img_url
-
-
-def _download_title_image(soup, args):
+    tags = {'thumbs': {}, 'links': {}}
+    for t in soup.find_all(['a', 'img']):
+        if t.name == 'img':
+            alt = t.get('alt', '')
+            for prefix, kind in THUMB_ALTS.items():
+                if alt.startswith(prefix):
+                    tags['thumbs'].setdefault(kind, t)
+                    break
+        else:
+            kind = GALLERY_TEXTS.get(t.text)
+            if kind is not None:
+                tags['links'].setdefault(kind, t)
+    return tags
+
+
+def _download_kind_image(tags, kind, args):
     """
-    download box image
-    :param soup: the source soup
+    get an image url from the game page
+    :param tags: from _get_image_tags()
+    :param kind: 'ingame', 'title' or 'box'
     :param args: arguments from cmdline
     :return: string
     """
     if args.img_thumbnail:
         # thumbnail
-        img_url = 'http://www.gamesdatabase.org%s' % soup.find(_find_title_thumb_tag)['src']
+        img_url = 'http://www.gamesdatabase.org%s' % tags['thumbs'][kind]['src']
     else:
         # full
-        href = 'http://www.gamesdatabase.org%s' % soup.find(_find_a_text_title)['href']
-        reply = requests.get(href)
+        href = 'http://www.gamesdatabase.org%s' % tags['links'][kind]['href']
+        reply = vscraper_utils.http_get(href)
         html = reply.content
         s = BeautifulSoup(html, 'html.parser')
         img_url = 'http://www.gamesdatabase.org%s' % s.find(_find_full_img_tag)['src']
@@ -130,7 +82,7 @@ def _download_title_image(soup, args):
 def _download_image(soup, args):
     """
     download game image
-    :param soup: the source soup
+    :param soup: the game page soup
     :param machine: the system
     :param args: arguments from cmdline
     :return: image buffer, or None
@@ -138,12 +90,15 @@ def _download_image(soup, args):
 
     got_cover = False
     img_url = ''
+    tags = _get_image_tags(soup)
 
     if args.img_index == -1:
         try:
             # try to download cover
-            img_url = _download_box_image(soup, args)
+            img_url = _download_kind_image(tags, 'box', args)
             got_cover = True
+        except vscraper_utils.PROPAGATED_EXCEPTIONS:
+            raise
         except Exception as e:
             # fallback to 0
             args.img_index = 0
@@ -154,22 +109,26 @@ def _download_image(soup, args):
             try:
                 if args.img_index == 0:
                     # get ingame
-                    img_url = _download_ingame_image(soup, args)
+                    img_url = _download_kind_image(tags, 'ingame', args)
                 else:
                     # get title
-                    img_url = _download_title_image(soup, args)
+                    img_url = _download_kind_image(tags, 'title', args)
+            except vscraper_utils.PROPAGATED_EXCEPTIONS:
+                raise
             except:
                 # fallback to ingame, in case
-                img_url = _download_ingame_image(soup, args)
+                img_url = _download_kind_image(tags, 'ingame', args)
 
         # download
-        reply = requests.get(img_url)
+        reply = vscraper_utils.http_get(img_url)
         img = reply.content
 
         # convert to png
         img_buffer = vscraper_utils.img_to_png(img)
         return img_buffer
 
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except Exception as e:
         return None
 
@@ -179,14 +138,15 @@ def run_direct_url(u, args):
     perform query with the given direct url
     :param u: the game url
     :param args: arguments from cmdline
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
     """
     # issue request
-    reply = requests.get(u)
+    reply = vscraper_utils.http_get(u)
     if not reply.ok:
         raise ConnectionError
 
     game_info = {}
+    game_info['url'] = u
 
     # got game page
     html = reply.content
@@ -222,102 +182,165 @@ def run_direct_url(u, args):
         game_info['desc'] = ''
 
     # image
-    game_info['img_buffer'] = _download_image(soup, args)
+    game_info['img_buffer'] = None
+    if vscraper_utils.wants_field(args, 'image'):
+        game_info['img_buffer'] = _download_image(soup, args)
 
     return game_info
 
 
-def _find_a_text_system(tag):
-    if tag.name == 'a' and "'GridView1','System$" in tag['href']:
-        return True
-    return False
-
-
-def _find_a_text_game(tag):
-    if tag.name == 'a' and "'GridView1','GAME$" in tag['href']:
-        return True
-    return False
+# results grid links, by column
+GRID_LINK = re.compile(r"'GridView1','(System|GAME|PUB|YR)\$")
 
 
-def _find_a_text_publisher(tag):
-    if tag.name == 'a' and "'GridView1','PUB$" in tag['href']:
-        return True
-    return False
-
-
-def _find_a_text_year(tag):
-    if tag.name == 'a' and "'GridView1','YR$" in tag['href']:
-        return True
-    return False
-
-
-def _check_response(reply, the_system):
+def _get_result_rows(soup):
+    """
+    collect the results grid rows, in a single pass on the links
+    :param soup: the results page soup
+    :return: [{ 'System': [a], 'GAME': [a], 'PUB': [a], 'YR': [a] }], one per row with a system
     """
-    check server response (not found, single, multi)
+    rows = {}
+    others = []
+    for a in soup.find_all('a', href=True):
+        m = GRID_LINK.search(a['href'])
+        if m is None:
+            continue
+        if m.group(1) == 'System':
+            # the row holding the system link
+            row = a.parent.parent.parent
+            rows.setdefault(id(row), {'System': [], 'GAME': [], 'PUB': [], 'YR': []})['System'].append(a)
+        else:
+            others.append((m.group(1), a))
+
+    # assign the other links to their row
+    for column, a in others:
+        p = a.parent
+        while p is not None and id(p) not in rows:
+            p = p.parent
+        if p is not None:
+            rows[id(p)][column].append(a)
+    return list(rows.values())
+
+
+def _parse_results(reply):
+    """
+    parse the results page, for every system
     :param reply: the server reply
-    :param the_system: the system of interest
     :return: [{name,publisher,year,url,system}] (each except 'name' may be empty)
     """
     html = reply.content
     soup = BeautifulSoup(html, 'html.parser')
 
-    all_systems = soup.find_all(_find_a_text_system)
+    # slugs are computed once per page
+    slugs = {}
     games = []
-    for g in all_systems:
-        slugified_text = slugify(g.text)
-        slugified_system = slugify(the_system)
-        if slugified_system in slugified_text:
-            # found a game entry for the requested system
-            p = g.parent.parent.parent
+    for row in _get_result_rows(soup):
+        if len(row['GAME']) < 2:
+            # not a game row
+            continue
+
+        for g in row['System']:
+            if g.text not in slugs:
+                slugs[g.text] = slugify(g.text)
             entry = {}
-            entry['name'] = p.find_all(_find_a_text_game)[1].text.replace('\'','')
-            entry['publisher'] = p.find(_find_a_text_publisher).text
-            entry['year'] = p.find(_find_a_text_year).text
+            entry['name'] = row['GAME'][1].text.replace('\'', '')
+            entry['publisher'] = row['PUB'][0].text if len(row['PUB']) > 0 else ''
+            entry['year'] = row['YR'][0].text if len(row['YR']) > 0 else ''
             slugified_gamename = slugify(entry['name'])
-            # print('system: %s, game: %s' % (slugified_text, slugified_gamename))
-            entry['url'] = 'http://www.gamesdatabase.org/game/%s/%s' % (slugified_text, slugified_gamename)
+            entry['url'] = 'http://www.gamesdatabase.org/game/%s/%s' % (slugs[g.text], slugified_gamename)
             entry['system'] = g.text
             games.append(entry)
+    return games
+
 
-    if len(games) is 0:
+def _check_response(results, the_system):
+    """
+    check the results (not found, single, multi) for the system of interest
+    :param results: the results of every system, from _parse_results()
+    :param the_system: the system of interest
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :return: [{name,publisher,year,url,system}] (each except 'name' may be empty)
+    """
+    slugified_system = slugify(the_system)
+    slugs = {}
+    games = []
+    for entry in results:
+        if entry['system'] not in slugs:
+            slugs[entry['system']] = slugify(entry['system'])
+        if slugified_system in slugs[entry['system']]:
+            # found a game entry for the requested system
+            games.append(entry)
+
+    if len(games) == 0:
         # not found
         raise vscraper_utils.GameNotFoundException
 
     return games
 
 
-def run(args):
+def search(args):
     """
-    perform query with the given game title
+    search for the given game title, without downloading the game page
     :param args: arguments from cmdline
     :throws vscraper_utils.GameNotFoundException when a game is not found
-    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: [{ name, publisher, year, url, system}] (each except 'url' may be empty)
     """
     if args.engine_params is None:
-        print(
+        raise ValueError(
             '--engine_params system=... is required (use --list_engines to check supported systems)')
-        raise ValueError
 
     # get system
     s = vscraper_utils.get_csv_parameter(args.engine_params, 'system')
 
-    # get game id
-    params = {'in': 1, 'searchtext': args.to_search, 'searchtype': 1}
-    u = 'http://www.gamesdatabase.org/list.aspx'
-    reply = requests.get(u, params=params)
+    # the results page lists every system, so it is parsed once and kept for the other systems
+    max_age = getattr(args, 'search_cache_days', 30) * 86400
+    query = ' '.join(args.to_search.lower().split())
+    cache = None
+    results = None
+    if max_age > 0:
+        try:
+            cache = vscraper_db.open_cache()
+            results = cache.get_listing(name(), query, max_age)
+            vscraper_log.cache_lookup(results is not None)
+        except (OSError, sqlite3.Error) as e:
+            # unwritable/locked/corrupted cache, search without it
+            vscraper_log.log.warning('Search cache not available (%s), not caching', e)
+            cache = None
+    if results is None:
+        # get game id
+        params = {'in': 1, 'searchtext': args.to_search, 'searchtype': 1}
+        u = 'http://www.gamesdatabase.org/list.aspx'
+        reply = vscraper_utils.http_get(u, params=params)
+
+        # check response
+        if not reply.ok:
+            raise ConnectionError
+
+        results = _parse_results(reply)
+        if cache is not None:
+            try:
+                cache.put_listing(name(), query, results)
+            except sqlite3.Error as e:
+                vscraper_log.log.warning('Search cache not available (%s), not caching', e)
 
-    # check response
-    if not reply.ok:
-        raise ConnectionError
+    return _check_response(results, s)
 
-    choices = _check_response(reply, s)
+
+def run(args):
+    """
+    perform query with the given game title
+    :param args: arguments from cmdline
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
+    """
+    choices = search(args)
     if len(choices) > 1:
         # return to es-vscraper with a multi choice
         raise vscraper_utils.MultipleChoicesException(choices)
 
-    # got single response, reissue
-    return run_direct_url(choices[0]['url'], args)
+    # got single response, use the listing row if it carries the fields asked for, or reissue
+    return vscraper_utils.run_listing_choice(choices[0], args, run_direct_url)
 
 
 def name():
@@ -351,3 +374,11 @@ def engine_help():
     """
     return """system=name: specifies target system, substring allowed ("amiga", "spectrum", "coleco", ...)
         note: img_index=0 (default) downloads in-game screen, img_index=1 downloads title screen (fallback to in-game if not found)"""
+
+
+def capabilities():
+    """
+    the optional features supported by the plugin
+    :return: [string] ('fields': only the fields in '--fields' are requested, 'listing': search results carry name, publisher and year)
+    """
+    return ['fields', 'listing']
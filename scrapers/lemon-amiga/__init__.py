@@ -1 +1 @@
-__all__ = ['run', 'run_direct_url', 'system', 'system_short', 'url', 'name', 'engine_help']
+__all__ = ['run', 'run_direct_url', 'search', 'system', 'system_short', 'url', 'name', 'engine_help', 'capabilities']
@@ -17,7 +17,6 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import re
 
-import requests
 from bs4 import BeautifulSoup
 import vscraper_utils
 
@@ -40,7 +39,7 @@ def _download_image(soup, u, args):
             if not args.img_thumbnail:
                 # prefer the full picture
                 cover_url = 'http://www.lemonamiga.com/games/%s' % covers[0]['href']
-                reply = requests.get(cover_url)
+                reply = vscraper_utils.http_get(cover_url)
                 html = reply.content
                 s = BeautifulSoup(html, 'html.parser')
                 img_urls = s.find_all('img', {'name': 'box'})
@@ -50,6 +49,8 @@ def _download_image(soup, u, args):
                 img_url = 'http://www.lemonamiga.com%s' % covers[0].find('img')['src']
 
             got_cover = True
+        except vscraper_utils.PROPAGATED_EXCEPTIONS:
+            raise
         except Exception as e:
             # fallback to 0
             args.img_index = 0
@@ -61,7 +62,7 @@ def _download_image(soup, u, args):
             r = re.search('(.+=)([0-9]+)', u)
             gameid = r.group(2)
 
-            reply = requests.get('http://www.lemonamiga.com/games/screens.php?id=%s' % gameid)
+            reply = vscraper_utils.http_get('http://www.lemonamiga.com/games/screens.php?id=%s' % gameid)
             html = reply.content
             s = BeautifulSoup(html, 'html.parser')
             img_urls = s.find_all('img')
@@ -77,13 +78,15 @@ def _download_image(soup, u, args):
                 img_url = img_url.replace('/small/', '/full/')
 
         # download
-        reply = requests.get(img_url)
+        reply = vscraper_utils.http_get(img_url)
         img = reply.content
 
         # convert to png
         img_buffer = vscraper_utils.img_to_png(img)
         return img_buffer
 
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except Exception as e:
         return None
 
@@ -99,7 +102,7 @@ def _download_descr(soup, u):
     # search for review / description
     try:
         review_url = vscraper_utils.find_href(soup, '/reviews/view.php')[0]['href']
-        reply = requests.get('http://www.lemonamiga.com%s' % review_url)
+        reply = vscraper_utils.http_get('http://www.lemonamiga.com%s' % review_url)
 
         # got review page
         html = reply.content
@@ -108,18 +111,22 @@ def _download_descr(soup, u):
         s = BeautifulSoup(html, 'html.parser')
         descr = s.find_all('td')[22].text.strip()
         return descr
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except:
         # no review, try comments
         try:
             r = re.search('(.+=)([0-9]+)', u)
             gameid = r.group(2)
-            reply = requests.get('http://www.lemonamiga.com/games/comments/text.php?game_id=%s' % gameid)
+            reply = vscraper_utils.http_get('http://www.lemonamiga.com/games/comments/text.php?game_id=%s' % gameid)
             html = reply.content
             s = BeautifulSoup(html, 'html.parser')
             spans = s.find_all('span')
             sib = spans[0].next_sibling
             descr = sib.contents[0].strip()
             return descr
+        except vscraper_utils.PROPAGATED_EXCEPTIONS:
+            raise
         except:
             return ''
 
@@ -129,14 +136,15 @@ def run_direct_url(u, args):
     perform query with the given direct url
     :param u: the game url
     :param args: arguments from cmdline
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
     """
     # issue request
-    reply = requests.get(u)
+    reply = vscraper_utils.http_get(u)
     if not reply.ok:
         raise ConnectionError
 
     game_info = {}
+    game_info['url'] = u
 
     # got game page
     html = reply.content
@@ -164,11 +172,13 @@ def run_direct_url(u, args):
     # genre
     vscraper_utils.add_text_from_href(soup, 'list.php?list_genre', game_info, 'genre')
 
-    # description
-    game_info['desc'] = _download_descr(soup, u)
+    # description (a further request)
+    game_info['desc'] = _download_descr(soup, u) if vscraper_utils.wants_field(args, 'desc') else ''
 
     # image
-    game_info['img_buffer'] = _download_image(soup, u, args)
+    game_info['img_buffer'] = None
+    if vscraper_utils.wants_field(args, 'image'):
+        game_info['img_buffer'] = _download_image(soup, u, args)
 
     return game_info
 
@@ -200,24 +210,34 @@ def _check_response(reply):
     return choices
 
 
-def run(args):
+def search(args):
     """
-    perform query with the given game title
+    search for the given game title, without downloading the game page
     :param args: arguments from cmdline
     :throws vscraper_utils.GameNotFoundException when a game is not found
-    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: [{ name, publisher, year, url, system}] (each except 'url' may be empty)
     """
     # get game id
     params = {'list_title': args.to_search}
     u = 'http://www.lemonamiga.com/games/list.php'
-    reply = requests.get(u, params=params)
+    reply = vscraper_utils.http_get(u, params=params)
 
     # check response
     if not reply.ok:
         raise ConnectionError
 
-    choices = _check_response(reply)
+    return _check_response(reply)
+
+
+def run(args):
+    """
+    perform query with the given game title
+    :param args: arguments from cmdline
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
+    """
+    choices = search(args)
     if len(choices) > 1:
         # return to es-vscraper with a multi choice
         raise vscraper_utils.MultipleChoicesException(choices)
@@ -256,3 +276,11 @@ def engine_help():
     :return: string
     """
     return ''
+
+
+def capabilities():
+    """
+    the optional features supported by the plugin
+    :return: [string] ('fields': only the fields in '--fields' are requested)
+    """
+    return ['fields']
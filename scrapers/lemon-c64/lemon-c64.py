@@ -18,7 +18,6 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import re
 
-import requests
 from bs4 import BeautifulSoup
 import vscraper_utils
 
@@ -41,7 +40,7 @@ def _download_image(soup, args):
                 r = re.search('(.+=)([0-9]+)', soup.find('link', rel='canonical').attrs['href'])
                 gameid = r.group(2)
                 u = 'http://www.lemon64.com/games/view_cover.php?gameID=%s' % gameid
-                reply = requests.get(u)
+                reply = vscraper_utils.http_get(u)
                 html = reply.content
                 s = BeautifulSoup(html, 'html.parser')
                 img_url = s.find('img').attrs['src']
@@ -50,6 +49,8 @@ def _download_image(soup, args):
                 img_url = soup.find('img', {'name': 'imgCover'})['src']
 
             got_cover = True
+        except vscraper_utils.PROPAGATED_EXCEPTIONS:
+            raise
         except Exception as e:
             # fallback to 0
             args.img_index = 0
@@ -68,13 +69,15 @@ def _download_image(soup, args):
             img_url = selected_img.attrs['src']
 
         # download
-        reply = requests.get(img_url)
+        reply = vscraper_utils.http_get(img_url)
         img = reply.content
 
         # convert to png
         img_buffer = vscraper_utils.img_to_png(img)
         return img_buffer
 
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except Exception as e:
         return None
 
@@ -89,7 +92,7 @@ def _download_descr(soup):
     # search for review / description
     try:
         review_url = vscraper_utils.find_href(soup, '/reviews/view.php')[0]['href']
-        reply = requests.get('http://www.lemon64.com%s' % review_url)
+        reply = vscraper_utils.http_get('http://www.lemon64.com%s' % review_url)
 
         # got review page
         html = reply.content
@@ -99,17 +102,21 @@ def _download_descr(soup):
         descr = s.find('td', 'tablecolor').text.strip()
         descr = descr[:descr.rfind('Downloads:')]
         return descr
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except:
         # no review, try comments
         try:
             r = re.search('(.+=)([0-9]+)', soup.find('link', rel='canonical').attrs['href'])
             gameid = r.group(2)
-            reply = requests.get('http://www.lemon64.com/games/comments/text.php?gameID=%s' % gameid)
+            reply = vscraper_utils.http_get('http://www.lemon64.com/games/comments/text.php?gameID=%s' % gameid)
             html = reply.content
             s = BeautifulSoup(html, 'html.parser')
             tds = s.find_all(target='content')
             descr = tds[0].next_sibling.next_sibling.text.strip()
             return descr
+        except vscraper_utils.PROPAGATED_EXCEPTIONS:
+            raise
         except:
             return ''
 
@@ -119,14 +126,15 @@ def run_direct_url(u, args):
     perform query with the given direct url
     :param u: the game url
     :param args: arguments from cmdline
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
     """
     # issue request
-    reply = requests.get(u)
+    reply = vscraper_utils.http_get(u)
     if not reply.ok:
         raise ConnectionError
 
     game_info = {}
+    game_info['url'] = u
 
     # got game page
     html = reply.content
@@ -152,11 +160,13 @@ def run_direct_url(u, args):
     # genre
     vscraper_utils.add_text_from_href(soup, 'list.php?genre', game_info, 'genre')
 
-    # description
-    game_info['desc'] = _download_descr(soup)
+    # description (a further request)
+    game_info['desc'] = _download_descr(soup) if vscraper_utils.wants_field(args, 'desc') else ''
 
     # image
-    game_info['img_buffer'] = _download_image(soup, args)
+    game_info['img_buffer'] = None
+    if vscraper_utils.wants_field(args, 'image'):
+        game_info['img_buffer'] = _download_image(soup, args)
 
     return game_info
 
@@ -194,30 +204,40 @@ def _check_response(reply):
     return choices
 
 
-def run(args):
+def search(args):
     """
-    perform query with the given game title
+    search for the given game title, without downloading the game page
     :param args: arguments from cmdline
     :throws vscraper_utils.GameNotFoundException when a game is not found
-    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: [{ name, publisher, year, url, system}] (each except 'url' may be empty)
     """
     # get game id
     params = {'type': 'title', 'name': args.to_search}
     u = 'http://www.lemon64.com/games/list.php'
-    reply = requests.get(u, params=params)
+    reply = vscraper_utils.http_get(u, params=params)
 
     # check response
     if not reply.ok:
         raise ConnectionError
 
-    choices = _check_response(reply)
+    return _check_response(reply)
+
+
+def run(args):
+    """
+    perform query with the given game title
+    :param args: arguments from cmdline
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
+    """
+    choices = search(args)
     if len(choices) > 1:
         # return to es-vscraper with a multi choice
         raise vscraper_utils.MultipleChoicesException(choices)
 
-    # got single response, reissue
-    return run_direct_url(choices[0]['url'], args)
+    # got single response, use the listing row if it carries the fields asked for, or reissue
+    return vscraper_utils.run_listing_choice(choices[0], args, run_direct_url)
 
 
 def name():
@@ -250,3 +270,11 @@ def engine_help():
     :return: string
     """
     return ''
+
+
+def capabilities():
+    """
+    the optional features supported by the plugin
+    :return: [string] ('fields': only the fields in '--fields' are requested, 'listing': search results carry name, publisher and year)
+    """
+    return ['fields', 'listing']
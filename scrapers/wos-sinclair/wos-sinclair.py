@@ -18,7 +18,6 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import re
 
-import requests
 from bs4 import BeautifulSoup
 import urllib
 import vscraper_utils
@@ -67,13 +66,15 @@ def _download_image(soup, args):
                     img_url = urllib.parse.urljoin(base, soup.find('img', title='In-game screen')['src'])
 
         # download
-        reply = requests.get(img_url)
+        reply = vscraper_utils.http_get(img_url)
         img = reply.content
 
         # convert to png
         img_buffer = vscraper_utils.img_to_png(img)
         return img_buffer
 
+    except vscraper_utils.PROPAGATED_EXCEPTIONS:
+        raise
     except Exception as e:
         return None
 
@@ -83,14 +84,15 @@ def run_direct_url(u, args):
     perform query with the given direct url
     :param u: the game url
     :param args: arguments from cmdline
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
     """
     # issue request
-    reply = requests.get(u)
+    reply = vscraper_utils.http_get(u)
     if not reply.ok:
         raise ConnectionError
 
     game_info = {}
+    game_info['url'] = u
 
     # got game page
     html = reply.content
@@ -129,7 +131,9 @@ def run_direct_url(u, args):
     game_info['desc'] = ''
 
     # image
-    game_info['img_buffer'] = _download_image(soup, args)
+    game_info['img_buffer'] = None
+    if vscraper_utils.wants_field(args, 'image'):
+        game_info['img_buffer'] = _download_image(soup, args)
 
     return game_info
 
@@ -177,30 +181,40 @@ def _check_response(reply):
     return choices
 
 
-def run(args):
+def search(args):
     """
-    perform query with the given game title
+    search for the given game title, without downloading the game page
     :param args: arguments from cmdline
     :throws vscraper_utils.GameNotFoundException when a game is not found
-    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
-    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer } (each except 'name' may be empty)
+    :return: [{ name, publisher, year, url, system}] (each except 'url' may be empty)
     """
     # get game id
     params = {'what': '1', 'regexp': args.to_search, 'loadpics': 3, 'yrorder': '1','scorder':'1','have':'1','also':'1','sort':'1','display':'1'}
     u = 'http://www.worldofspectrum.org/infoseekadv.cgi'
-    reply = requests.get(u, params=params)
+    reply = vscraper_utils.http_get(u, params=params)
 
     # check response
     if not reply.ok:
         raise ConnectionError
 
-    choices = _check_response(reply)
+    return _check_response(reply)
+
+
+def run(args):
+    """
+    perform query with the given game title
+    :param args: arguments from cmdline
+    :throws vscraper_utils.GameNotFoundException when a game is not found
+    :throws vscraper_utils.MultipleChoicesException when multiple choices are found. ex.choices() returns [{ name, publisher, year, url, system}] (each except 'name' may be empty)
+    :return: dictionary { name, publisher, developer, genre, releasedate, desc, png_img_buffer, url } (each except 'name' may be empty)
+    """
+    choices = search(args)
     if len(choices) > 1:
         # return to es-vscraper with a multi choice
         raise vscraper_utils.MultipleChoicesException(choices)
 
-    # got single response, reissue
-    return run_direct_url(choices[0]['url'], args)
+    # got single response, use the listing row if it carries the fields asked for, or reissue
+    return vscraper_utils.run_listing_choice(choices[0], args, run_direct_url)
 
 
 def name():
@@ -233,3 +247,11 @@ def engine_help():
     :return: string
     """
     return 'note: img_index=0 (default) downloads in-game screen, img_index=1 downloads title screen (fallback to in-game if not found)'
+
+
+def capabilities():
+    """
+    the optional features supported by the plugin
+    :return: [string] ('fields': only the fields in '--fields' are requested, 'listing': search results carry name, publisher and year)
+    """
+    return ['fields', 'listing']
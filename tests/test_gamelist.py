@@ -0,0 +1,106 @@
+"""
+es-vscraper gamelist streaming tests (run with 'python -m unittest discover tests')
+"""
+
+import importlib.util
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import vscraper_utils
+
+_spec = importlib.util.spec_from_file_location('es_vscraper', os.path.join(ROOT, 'es-vscraper.py'))
+es_vscraper = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(es_vscraper)
+
+GAMELIST = '''<?xml version="1.0"?>
+<gameList version="2">
+  <provider>
+    <System>Commodore 64</System>
+  </provider>
+  <folder>
+    <path>./demos</path>
+    <name>Demos</name>
+  </folder>
+  <!-- hand edited -->
+  <game id="1" source="lemon64">
+    <path>/roms/alpha.d64</path>
+    <name>Alpha</name>
+  </game>
+  <game id="2">
+    <path>/roms/beta.d64</path>
+    <name>Beta</name>
+  </game>
+</gameList>
+'''
+
+
+class PurgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'gamelist.xml')
+        with open(self.path, 'w') as f:
+            f.write(GAMELIST)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_keeps_other_nodes(self):
+        out = self.path + '.tmp'
+        removed = es_vscraper.drop_game_entries(self.path, out, vscraper_utils.compile_patterns(['.*beta'], re.I))
+        self.assertEqual(removed, [('/roms/beta.d64', 'Beta')])
+
+        from lxml import etree
+        root = etree.parse(out).getroot()
+        self.assertEqual(root.get('version'), '2')
+        self.assertEqual(root.findtext('provider/System'), 'Commodore 64')
+        self.assertEqual(root.findtext('folder/path'), './demos')
+        self.assertEqual([c.text for c in root if not isinstance(c.tag, str)], [' hand edited '])
+        games = root.findall('game')
+        self.assertEqual([g.findtext('name') for g in games], ['Alpha'])
+        self.assertEqual(games[0].attrib, {'id': '1', 'source': 'lemon64'})
+
+    def test_patterns_matched_one_by_one(self):
+        # a backreference and a global inline flag, as written by the user
+        matcher = vscraper_utils.compile_patterns(['.*/(a)lph\\1', '(?i).*BETA'])
+        self.assertIsNotNone(matcher.match('/roms/alpha.d64'))
+        self.assertIsNotNone(matcher.match('/roms/beta.d64'))
+        self.assertIsNone(matcher.match('/roms/gamma.d64'))
+
+
+class MergeTest(unittest.TestCase):
+
+    def test_merge_keeps_nodes_and_attributes(self):
+        import types
+        from lxml import etree
+
+        with tempfile.TemporaryDirectory() as d:
+            old = os.path.join(d, 'old.xml')
+            new = os.path.join(d, 'new.xml')
+            out = os.path.join(d, 'gamelist.xml')
+            with open(old, 'w') as f:
+                f.write(GAMELIST)
+            with open(new, 'w') as f:
+                f.write('<gameList><provider><System>Commodore 64</System></provider>'
+                        '<game id="3"><path>/roms/alpha.d64</path><name>Alpha 2</name><desc></desc></game>'
+                        '<game><path>/roms/gamma.d64</path><name>Gamma</name></game></gameList>')
+            os.utime(old, (0, 0))
+
+            args = types.SimpleNamespace(merge=[old, new], merge_policy='non_empty', merge_prefer=0,
+                                         gamelist_path=out)
+            es_vscraper.merge_gamelists(args)
+            root = etree.parse(out).getroot()
+            self.assertEqual(root.get('version'), '2')
+            self.assertEqual(len(root.findall('provider')), 1)
+            self.assertEqual(root.findtext('folder/path'), './demos')
+            self.assertEqual([g.findtext('name') for g in root.findall('game')], ['Alpha 2', 'Beta', 'Gamma'])
+            self.assertEqual(root.find('game').attrib, {'id': '3', 'source': 'lemon64'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+gamesdatabase-misc results page tests, on a synthetic multi-system page: the single-pass parser must return what
+the former per-row tree walks did, parsing the page once for every system (run with 'python -m unittest discover tests')
+"""
+
+import importlib.util
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bs4 import BeautifulSoup
+from slugify import slugify
+
+_spec = importlib.util.spec_from_file_location(
+    'gamesdatabase_misc', os.path.join(ROOT, 'scrapers', 'gamesdatabase-misc', 'gamesdatabase-misc.py'))
+gamesdatabase = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gamesdatabase)
+
+SYSTEMS = ['Atari 2600', 'Atari 5200', 'Commodore 64', 'Nintendo NES', 'Sega Genesis', 'Arcade']
+
+# rows in the fixture page
+ROWS = 600
+
+
+def _postback(column, idx):
+    return "javascript:__doPostBack('GridView1','%s$%d')" % (column, idx)
+
+
+def results_page(rows):
+    """
+    build a results page as served by gamesdatabase.org (a GridView with system, game, publisher and year links)
+    :param rows: number of rows
+    :return: bytes
+    """
+    html = ['<html><body><a href="/">home</a><table id="GridView1">']
+    for i in range(rows):
+        html.append('<tr><td><span><a href="%s">%s</a></span></td>'
+                    '<td><a href="%s"><img src="/thumb/%d.png"></a> <a href="%s">Game\'s %d</a></td>'
+                    '<td><a href="%s">Publisher %d</a></td><td><a href="%s">%d</a></td></tr>' % (
+                        _postback('System', i), SYSTEMS[i % len(SYSTEMS)], _postback('GAME', i), i,
+                        _postback('GAME', i), i // 3, _postback('PUB', i), i % 17, _postback('YR', i), 1980 + i % 20))
+    html.append('</table></body></html>')
+    return ''.join(html).encode('utf-8')
+
+
+def legacy_check_response(html, the_system):
+    """
+    the former parser: a whole-tree walk per column, per row (reference for the results)
+    """
+    def _column(name):
+        return lambda tag: tag.name == 'a' and "'GridView1','%s$" % name in tag.get('href', '')
+
+    soup = BeautifulSoup(html, 'html.parser')
+    games = []
+    for g in soup.find_all(_column('System')):
+        slugified_text = slugify(g.text)
+        if slugify(the_system) in slugified_text:
+            p = g.parent.parent.parent
+            entry = {'name': p.find_all(_column('GAME'))[1].text.replace('\'', ''),
+                     'publisher': p.find(_column('PUB')).text, 'year': p.find(_column('YR')).text}
+            entry['url'] = 'http://www.gamesdatabase.org/game/%s/%s' % (slugified_text, slugify(entry['name']))
+            entry['system'] = g.text
+            games.append(entry)
+    return games
+
+
+class Reply:
+    def __init__(self, content):
+        self.content = content
+
+
+class ResultsTest(unittest.TestCase):
+
+    def test_same_results_single_parse(self):
+        html = results_page(ROWS)
+        expected = [legacy_check_response(html, s) for s in SYSTEMS]
+
+        with mock.patch.object(gamesdatabase, 'BeautifulSoup', wraps=BeautifulSoup) as parser:
+            results = gamesdatabase._parse_results(Reply(html))
+            got = [gamesdatabase._check_response(results, s) for s in SYSTEMS]
+
+        self.assertEqual(got, expected)
+        self.assertEqual(sum(len(g) for g in got), ROWS)
+        self.assertEqual(parser.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+es-vscraper image store tests (run with 'python -m unittest discover tests')
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import vscraper_utils
+
+
+class GcTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.img_dir = self._dir.name
+        self.blobs = {}
+        for name in ('alpha', 'beta', 'gamma'):
+            self.blobs[name] = vscraper_utils.get_image_blob(self.img_dir, name.encode())
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _image(self, name):
+        return os.path.join(self.img_dir, '%s.png' % name)
+
+    def test_purged_links_are_collected(self):
+        for name in self.blobs:
+            vscraper_utils.link_image_blob(self.blobs[name], self._image(name))
+
+        # beta was purged from the gamelist, its link is still there
+        referenced = {self._image('alpha'), self._image('gamma')}
+        images, blobs, _ = vscraper_utils.gc_image_blobs(self.img_dir, referenced)
+        self.assertEqual((images, blobs), (1, 1))
+        self.assertFalse(os.path.exists(self._image('beta')))
+        self.assertFalse(os.path.exists(self.blobs['beta']))
+        self.assertTrue(os.path.exists(self.blobs['alpha']))
+
+    def test_copies_keep_their_blobs(self):
+        # as stored on filesystems without hardlinks/symlinks
+        for name in self.blobs:
+            vscraper_utils.write_to_file(self._image(name), name.encode())
+        variant = self.blobs['gamma'][:-len('.png')] + '_160.png'
+        vscraper_utils.write_to_file(variant, b'small gamma')
+        vscraper_utils.write_to_file(self._image('gamma_160'), b'small gamma')
+        hashes = {self._image('gamma_160'): os.path.basename(variant)[:-len('.png')]}
+
+        referenced = {self._image('alpha'), self._image('gamma')}
+        images, blobs, _ = vscraper_utils.gc_image_blobs(self.img_dir, referenced, hashes, test=True)
+        self.assertEqual((images, blobs), (1, 1))
+
+        vscraper_utils.gc_image_blobs(self.img_dir, referenced, hashes)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.img_dir, vscraper_utils.BLOBS_FOLDER))),
+                         sorted(['%s.png' % hashlib.sha1(b'alpha').hexdigest(),
+                                 '%s.png' % hashlib.sha1(b'gamma').hexdigest(),
+                                 os.path.basename(variant)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+es-vscraper cold start tests: heavy dependencies are loaded only by the code paths using them
+(run with 'python -m unittest discover tests')
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the dependencies worth deferring
+HEAVY = ['lxml', 'fuzzywuzzy', 'PIL', 'requests']
+
+# run a command in a fresh interpreter, reporting the heavy modules it loaded
+PROBE = '''
+import importlib.util, json, sys
+sys.path.insert(0, %r)
+spec = importlib.util.spec_from_file_location('es_vscraper', %r)
+es_vscraper = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(es_vscraper)
+argv = %r
+if len(argv) > 0:
+    es_vscraper.run_command(es_vscraper.build_parser().parse_args(argv))
+    es_vscraper.vscraper_log.shutdown()
+print(json.dumps(sorted(m for m in %r if m in sys.modules)))
+'''
+
+# cold start budget (seconds) for loading the script, generous enough for a Pi
+MAX_STARTUP = 2.0
+
+
+def loaded_modules(argv):
+    """
+    run es-vscraper in a fresh interpreter
+    :param argv: the command line, [] to only load the script
+    :return: (the heavy modules loaded, elapsed seconds)
+    """
+    start = time.time()
+    out = subprocess.run([sys.executable, '-c', PROBE % (ROOT, os.path.join(ROOT, 'es-vscraper.py'), argv, HEAVY)],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, cwd=ROOT).stdout
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1]), time.time() - start
+
+
+class ImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self._dir.name, 'gamelist.xml'), 'w') as f:
+            f.write('<gameList>\n  <game>\n    <path>./a.d64</path>\n    <name>A</name>\n  </game>\n</gameList>\n')
+        with open(os.path.join(self._dir.name, 'a.d64'), 'w') as f:
+            f.write('a')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_startup(self):
+        modules, elapsed = loaded_modules([])
+        self.assertEqual(modules, [])
+        self.assertLess(elapsed, MAX_STARTUP)
+
+    def test_preprocess(self):
+        modules, _ = loaded_modules(['--path', self._dir.name, '--preprocess', '.*', '--preprocess_test'])
+        self.assertEqual(modules, [])
+
+    def test_purge(self):
+        modules, _ = loaded_modules(['--gamelist_path', os.path.join(self._dir.name, 'gamelist.xml'),
+                                     '--purge', 'nothing', '--purge_test'])
+        self.assertEqual(modules, ['lxml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+es-vscraper filename normalization tests, on a labelled corpus (run with 'python -m unittest discover tests')
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import vscraper_catalog
+import vscraper_names
+
+# filename, searched title, year, publisher
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'filenames.tsv')
+
+# share of the corpus whose search key must find the title
+MIN_HIT_RATE = 0.9
+
+
+def read_corpus():
+    """
+    read the labelled filenames
+    :return: [(filename, title, year or None, publisher or None)]
+    """
+    rows = []
+    with open(CORPUS, 'r', encoding='utf-8') as f:
+        for l in f:
+            if l.startswith('#') or len(l.strip()) == 0:
+                continue
+            filename, title, year, publisher = l.rstrip('\n').split('\t')
+            rows.append((filename, title, year or None, publisher or None))
+    return rows
+
+
+def hit_rate(rows, key):
+    """
+    get the share of filenames whose search key matches the title (as the engines compare them, case and
+    punctuation aside)
+    :param rows: from read_corpus()
+    :param key: filename -> search key
+    :return: float
+    """
+    hits = [r for r in rows if vscraper_catalog.normalize_title(key(r[0])) == vscraper_catalog.normalize_title(r[1])]
+    return len(hits) / len(rows)
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = read_corpus()
+
+    def test_first_query_hit_rate(self):
+        baseline = hit_rate(self.rows, lambda f: os.path.splitext(f)[0])
+        normalized = hit_rate(self.rows, lambda f: vscraper_names.parse_filename(f)['name'])
+        self.assertGreaterEqual(normalized, MIN_HIT_RATE)
+        self.assertGreater(normalized, baseline)
+
+    def test_hints(self):
+        for filename, _, year, publisher in self.rows:
+            info = vscraper_names.parse_filename(filename)
+            self.assertEqual((info['year'], info['publisher']), (year, publisher), filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
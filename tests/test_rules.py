@@ -0,0 +1,28 @@
+"""
+es-vscraper preprocess rules tests (run with 'python -m unittest discover tests')
+"""
+
+import os
+import re
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import vscraper_utils
+
+
+class RulesTest(unittest.TestCase):
+
+    def test_rules_matched_one_by_one(self):
+        # a backreference and an inline flag, which break once the rules are joined in a single regex
+        rules = [('exclude', None, r'(.)\1\1'), ('move', 'demos', r'(?s).*demo'), ('include', None, r'.*\.d64$')]
+        matcher = vscraper_utils.compile_rules(rules, re.I)
+        self.assertEqual(matcher.match_index('zzz.d64'), 0)
+        self.assertEqual(matcher.match_index('Best DEMO.d64'), 1)
+        self.assertEqual(matcher.match_index('game.d64'), 2)
+        self.assertEqual(matcher.match_index('game.txt'), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
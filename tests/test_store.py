@@ -0,0 +1,33 @@
+"""
+es-vscraper store tests (run with 'python -m unittest discover tests')
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import vscraper_db
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.store = vscraper_db.open_store(os.path.join(self._dir.name, vscraper_db.DB_NAME))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_replaced_games_keep_their_order(self):
+        self.store.put_games([{'path': '/roms/%s.d64' % n, 'name': n} for n in ('alpha', 'beta', 'gamma')])
+        self.store.put_game({'path': '/roms/alpha.d64', 'name': 'Alpha', 'genre': 'Puzzle'})
+        games = list(self.store.iter_games('/roms'))
+        self.assertEqual([g['name'] for g in games], ['Alpha', 'beta', 'gamma'])
+        self.assertEqual(games[0]['genre'], 'Puzzle')
+
+
+if __name__ == '__main__':
+    unittest.main()
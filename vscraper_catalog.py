@@ -0,0 +1,340 @@
+"""
+es-vscraper local catalogs, to resolve titles without searching online
+
+MIT-LICENSE
+
+Copyright 2017, Valerio 'valerino' Lupi <xoanino@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished
+to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import array
+import gzip
+import json
+import mmap
+import os
+import random
+import re
+import string
+import struct
+import sys
+import time
+import vscraper_log
+import vscraper_utils
+
+# default catalogs folder, in the es-vscraper folder
+CATALOGS_FOLDER = 'catalogs'
+
+# trigrams alphabet (normalized titles only contain these), a trigram is coded as a base-37 number
+TRIGRAM_ALPHABET = ' ' + string.digits + string.ascii_lowercase
+TRIGRAMS = len(TRIGRAM_ALPHABET) ** 3
+
+# fuzzy index file header: magic, entries count
+INDEX_MAGIC = b'VSX1'
+INDEX_HEADER = struct.Struct('<4sI')
+
+# loaded catalogs and fuzzy indexes, by path
+_catalogs = {}
+_indexes = {}
+
+
+def normalize_title(title):
+    """
+    normalize a title for matching (lowercase, alphanumeric words only)
+    :param title: the title
+    :return: string
+    """
+    return ' '.join(re.findall('[0-9a-z]+', title.lower()))
+
+
+def get_trigrams(title):
+    """
+    get the trigrams of a title
+    :param title: the title
+    :return: set of int
+    """
+    t = ' %s ' % normalize_title(title)
+    codes = [TRIGRAM_ALPHABET.index(c) for c in t]
+    return {(codes[i] * 37 + codes[i + 1]) * 37 + codes[i + 2] for i in range(len(codes) - 2)}
+
+
+def get_catalog_path(engine, args):
+    """
+    get the catalog path for an engine (and system, for multi-system engines)
+    :param engine: an engine module
+    :param args: arguments from cmdline
+    :return: path
+    """
+    folder = args.catalog_path
+    if folder is None:
+        folder = os.path.join(sys.path[0], CATALOGS_FOLDER)
+
+    name = engine.name()
+    if args.engine_params is not None:
+        system = vscraper_utils.get_csv_parameter(args.engine_params, 'system')
+        if system != '':
+            name += '-' + re.sub('[^0-9a-zA-Z]+', '-', system.lower())
+    return os.path.join(folder, '%s.jsonl.gz' % name)
+
+
+class Catalog:
+    """
+    the titles known to an engine, indexed by normalized name
+    """
+
+    def __init__(self, path):
+        self._entries = []
+        self._index = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for l in f:
+                self.add(json.loads(l))
+
+    def add(self, entry):
+        """
+        add an entry
+        :param entry: { name, publisher, year, url, system }
+        :return:
+        """
+        self._entries.append(entry)
+        self._index.setdefault(normalize_title(entry['name']), []).append(entry)
+
+    def entries(self):
+        """
+        all the entries
+        :return: [{ name, publisher, year, url, system }]
+        """
+        return self._entries
+
+    def lookup(self, title):
+        """
+        get the entries matching a title
+        :param title: the title
+        :return: [{ name, publisher, year, url, system }], may be empty
+        """
+        return self._index.get(normalize_title(title), [])
+
+
+class FuzzyIndex:
+    """
+    trigrams inverted index on a catalog, memory-mapped from disk.
+    layout: header, records offsets (n+1), records trigrams count (n), postings offsets (TRIGRAMS+1),
+    postings (entry ids), records (json)
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = INDEX_HEADER.unpack_from(self._mm, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError('%s is not a fuzzy index!' % path)
+
+        words = memoryview(self._mm)[INDEX_HEADER.size:].cast('B')
+        pos = 0
+        self._rec_offsets = words[pos:pos + (n + 1) * 4].cast('I')
+        pos += (n + 1) * 4
+        self._rec_trigrams = words[pos:pos + n * 4].cast('I')
+        pos += n * 4
+        self._post_offsets = words[pos:pos + (TRIGRAMS + 1) * 4].cast('I')
+        pos += (TRIGRAMS + 1) * 4
+        self._postings = words[pos:pos + self._post_offsets[TRIGRAMS] * 4].cast('I')
+        pos += self._post_offsets[TRIGRAMS] * 4
+        self._records = words[pos:]
+
+    @staticmethod
+    def build(path, entries):
+        """
+        build the index for catalog entries
+        :param path: the index path (will be overwritten)
+        :param entries: [{ name, publisher, year, url, system }]
+        :return:
+        """
+        rec_offsets = array.array('I', [0])
+        rec_trigrams = array.array('I')
+        records = bytearray()
+        postings_lists = {}
+        for idx, e in enumerate(entries):
+            records += json.dumps(e).encode('utf-8')
+            rec_offsets.append(len(records))
+            trigrams = get_trigrams(e['name'])
+            rec_trigrams.append(len(trigrams))
+            for t in trigrams:
+                postings_lists.setdefault(t, []).append(idx)
+
+        post_offsets = array.array('I', [0])
+        postings = array.array('I')
+        for t in range(TRIGRAMS):
+            postings.extend(postings_lists.get(t, []))
+            post_offsets.append(len(postings))
+
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(rec_trigrams)))
+            for a in (rec_offsets, rec_trigrams, post_offsets, postings):
+                a.tofile(f)
+            f.write(records)
+        os.replace(tmp_path, path)
+
+    def _record(self, idx):
+        """
+        get a record (internal)
+        """
+        return json.loads(bytes(self._records[self._rec_offsets[idx]:self._rec_offsets[idx + 1]]))
+
+    def _shared(self, query):
+        """
+        count the query trigrams shared by each entry (internal)
+        """
+        shared = {}
+        for t in query:
+            for idx in self._postings[self._post_offsets[t]:self._post_offsets[t + 1]]:
+                shared[idx] = shared.get(idx, 0) + 1
+        return shared
+
+    def lookup(self, title):
+        """
+        get the entries whose normalized name is the title's, as Catalog.lookup()
+        :param title: the title
+        :return: [{ name, publisher, year, url, system }], may be empty
+        """
+        query = get_trigrams(title)
+        if len(query) == 0:
+            return []
+
+        # only entries with exactly the query trigrams may match, then names are compared
+        name = normalize_title(title)
+        res = []
+        for idx, n in sorted(self._shared(query).items()):
+            if n == len(query) and self._rec_trigrams[idx] == n:
+                e = self._record(idx)
+                if normalize_title(e['name']) == name:
+                    res.append(e)
+        return res
+
+    def search(self, title, k=5):
+        """
+        get the best matching entries for a title
+        :param title: the title
+        :param k: maximum number of entries to return
+        :return: [{ name, publisher, year, url, system, score }] (score 0-100), best first
+        """
+        query = get_trigrams(title)
+        if len(query) == 0:
+            return []
+
+        # count the shared trigrams per entry
+        shared = self._shared(query)
+
+        # score (dice coefficient) only the entries sharing enough trigrams
+        min_shared = max(1, len(query) // 3)
+        scored = []
+        for idx, n in shared.items():
+            if n >= min_shared:
+                scored.append((200 * n // (len(query) + self._rec_trigrams[idx]), idx))
+        scored.sort(reverse=True)
+
+        res = []
+        for score, idx in scored[:k]:
+            e = self._record(idx)
+            e['score'] = score
+            res.append(e)
+        return res
+
+
+def get_index_path(catalog_path):
+    """
+    get the fuzzy index path for a catalog
+    :param catalog_path: path to the catalog
+    :return: path
+    """
+    return '%s.idx' % catalog_path
+
+
+def get_fuzzy_index(engine, args):
+    """
+    get the fuzzy index for an engine catalog, (re)building it if needed: the catalog itself is loaded only then,
+    otherwise the index is just memory-mapped
+    :param engine: an engine module
+    :param args: arguments from cmdline
+    :return: FuzzyIndex, or None if the catalog is not built yet
+    """
+    path = get_catalog_path(engine, args)
+    if path not in _indexes:
+        _indexes[path] = None
+        if os.path.exists(path):
+            idx_path = get_index_path(path)
+            if not os.path.exists(idx_path) or os.path.getmtime(idx_path) < os.path.getmtime(path):
+                FuzzyIndex.build(idx_path, get_catalog(engine, args).entries())
+            _indexes[path] = FuzzyIndex(idx_path)
+    return _indexes[path]
+
+
+def get_catalog(engine, args):
+    """
+    get the catalog for an engine, loading it once
+    :param engine: an engine module
+    :param args: arguments from cmdline
+    :return: Catalog, or None if not built yet
+    """
+    path = get_catalog_path(engine, args)
+    if path not in _catalogs:
+        _catalogs[path] = Catalog(path) if os.path.exists(path) else None
+    return _catalogs[path]
+
+
+def can_build_catalog(engine):
+    """
+    check if an engine can be crawled completely, through its optional catalog_pages() function listing its whole
+    library page by page (searches are capped by the sites, so they cannot fill a catalog)
+    :param engine: an engine module
+    :return: bool
+    """
+    return hasattr(engine, 'catalog_pages')
+
+
+def build_catalog(engine, args):
+    """
+    crawl the engine listing pages (throttled by '--sleep') into the local catalog
+    :param engine: an engine module, supporting can_build_catalog()
+    :param args: arguments from cmdline
+    :return: path to the catalog
+    """
+    # url -> entry
+    entries = {}
+    pages = engine.catalog_pages(args)
+    idx = 0
+    while True:
+        if idx > 0:
+            # sleep between 1 and sleep before the next page (avoid hammering)
+            time.sleep(random.randint(1, int(args.sleep)))
+        try:
+            choices = next(pages)
+        except StopIteration:
+            break
+
+        for c in choices:
+            entries[c['url']] = {'name': c['name'], 'publisher': c.get('publisher', ''),
+                                 'year': c.get('year', ''), 'url': c['url'], 'system': c.get('system', '')}
+        idx += 1
+        vscraper_log.log.info('Crawled page %d, %d titles so far', idx, len(entries))
+
+    path = get_catalog_path(engine, args)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.tmp' % path
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for e in entries.values():
+            f.write(json.dumps(e) + '\n')
+    os.replace(tmp_path, path)
+    _catalogs.pop(path, None)
+    _indexes.pop(path, None)
+
+    # and its fuzzy index
+    FuzzyIndex.build(get_index_path(path), list(entries.values()))
+    return path
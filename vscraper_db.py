@@ -0,0 +1,370 @@
+"""
+es-vscraper local store
+
+MIT-LICENSE
+
+Copyright 2017, Valerio 'valerino' Lupi <xoanino@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished
+to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# default store name, created next to gamelist.xml
+DB_NAME = '.es-vscraper.db'
+
+# shared cache, for what is reused across folders/systems (i.e. multi-system search results)
+CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                          'es-vscraper', 'cache.db')
+
+# games table columns, as in the <game> element (any other child goes to 'extra' as json)
+GAME_COLUMNS = ['name', 'developer', 'publisher', 'desc', 'genre', 'releasedate', 'path', 'image']
+
+# opened stores, by path
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class Store:
+    """
+    sqlite store for the scraped entries (gamelist.xml can be exported from here), their source urls
+    and validators, images hashes, scrape outcomes, the query variants found by searches, the crc index and the
+    parsed search results
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+        # WAL allows many processes to commit concurrently
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT);
+            CREATE TABLE IF NOT EXISTS games (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                name TEXT,
+                developer TEXT,
+                publisher TEXT,
+                desc TEXT,
+                genre TEXT,
+                releasedate TEXT,
+                image TEXT,
+                extra TEXT,
+                updated REAL);
+            CREATE INDEX IF NOT EXISTS games_dir ON games (dir);
+            CREATE INDEX IF NOT EXISTS games_image ON games (image);
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS images_hash ON images (hash);
+            CREATE TABLE IF NOT EXISTS scrapes (
+                path TEXT NOT NULL,
+                engine TEXT,
+                query TEXT,
+                result INTEGER,
+                ts REAL);
+            CREATE INDEX IF NOT EXISTS scrapes_path ON scrapes (path);
+            CREATE TABLE IF NOT EXISTS searches (
+                engine TEXT NOT NULL,
+                query TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                ts REAL,
+                PRIMARY KEY (engine, query));
+            CREATE TABLE IF NOT EXISTS crcs (
+                engine TEXT NOT NULL,
+                crc INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                name TEXT,
+                url TEXT,
+                PRIMARY KEY (engine, crc, size));
+            CREATE TABLE IF NOT EXISTS listings (
+                engine TEXT NOT NULL,
+                query TEXT NOT NULL,
+                rows TEXT NOT NULL,
+                ts REAL,
+                PRIMARY KEY (engine, query));''')
+        self._conn.commit()
+
+    def get_source(self, path):
+        """
+        get the source url of a scraped entry, with its validators
+        :param path: the game path
+        :return: (url, { etag, last_modified, content_hash }) or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT url, etag, last_modified, content_hash FROM sources WHERE path=?',
+                                     (path,)).fetchone()
+        if row is None:
+            return None
+        return row[0], {'etag': row[1], 'last_modified': row[2], 'content_hash': row[3]}
+
+    def set_source(self, path, url, validators):
+        """
+        set the source url of a scraped entry, with its validators
+        :param path: the game path
+        :param url: the url the entry has been scraped from
+        :param validators: { etag, last_modified, content_hash }, may be None to keep the ones already recorded
+            for the same url (i.e. entries built from a listing, with no page fetched)
+        :return:
+        """
+        with self._lock:
+            if validators is None:
+                row = self._conn.execute('SELECT url, etag, last_modified, content_hash FROM sources WHERE path=?',
+                                         (path,)).fetchone()
+                if row is not None and row[0] == url:
+                    validators = {'etag': row[1], 'last_modified': row[2], 'content_hash': row[3]}
+                else:
+                    validators = {'etag': None, 'last_modified': None, 'content_hash': None}
+            self._conn.execute('INSERT OR REPLACE INTO sources VALUES (?,?,?,?,?)',
+                               (path, url, validators['etag'], validators['last_modified'],
+                                validators['content_hash']))
+            self._conn.commit()
+
+    def put_game(self, entry):
+        """
+        add/replace a game
+        :param entry: dictionary { tag: text } as in the <game> element, 'path' must be absolute
+        :return:
+        """
+        self.put_games([entry])
+
+    def put_games(self, entries):
+        """
+        add/replace many games at once
+        :param entries: iterable of dictionaries { tag: text } as in the <game> element, 'path' must be absolute
+        :return:
+        """
+        now = time.time()
+        rows = []
+        for entry in entries:
+            extra = {k: v for k, v in entry.items() if k not in GAME_COLUMNS}
+            rows.append([entry.get(c) for c in GAME_COLUMNS] +
+                        [os.path.dirname(entry['path']), json.dumps(extra) if extra else None, now])
+        with self._lock:
+            # upsert, so replaced games keep their rowid (and their place in the exported gamelists)
+            self._conn.executemany('INSERT INTO games (%s, dir, extra, updated) VALUES (%s) '
+                                   'ON CONFLICT (path) DO UPDATE SET %s' % (
+                                       ','.join(GAME_COLUMNS), ','.join('?' * (len(GAME_COLUMNS) + 3)),
+                                       ','.join('%s=excluded.%s' % (c, c) for c in GAME_COLUMNS + ['dir', 'extra', 'updated']
+                                                if c != 'path')), rows)
+            self._conn.commit()
+
+    def _row_to_entry(self, row):
+        """
+        build a game dictionary from a games row (internal)
+        """
+        entry = {}
+        for i, c in enumerate(GAME_COLUMNS):
+            if row[i] is not None:
+                entry[c] = row[i]
+        if row[-1] is not None:
+            entry.update(json.loads(row[-1]))
+        return entry
+
+    def get_game(self, path):
+        """
+        get a game
+        :param path: the game path
+        :return: dictionary { tag: text } or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT %s, extra FROM games WHERE path=?' % ','.join(GAME_COLUMNS),
+                                     (path,)).fetchone()
+        if row is None:
+            return None
+        return self._row_to_entry(row)
+
+    def iter_games(self, folder):
+        """
+        get all the games in a folder
+        :param folder: the folder
+        :return: generator of dictionaries { tag: text }
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT %s, extra FROM games WHERE dir=? ORDER BY rowid' % ','.join(GAME_COLUMNS),
+                                      (folder,)).fetchall()
+        for row in rows:
+            yield self._row_to_entry(row)
+
+    def count_games(self, folder):
+        """
+        count the games in a folder
+        :param folder: the folder
+        :return: int
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM games WHERE dir=?', (folder,)).fetchone()[0]
+
+    def folders(self):
+        """
+        get all the folders having games
+        :return: [folder]
+        """
+        with self._lock:
+            return [r[0] for r in self._conn.execute('SELECT DISTINCT dir FROM games')]
+
+    def get_image_owners(self, image):
+        """
+        get the names of the games using an image
+        :param image: the image path
+        :return: [name]
+        """
+        with self._lock:
+            return [r[0] for r in self._conn.execute('SELECT name FROM games WHERE image=?', (image,))]
+
+    def delete_games(self, paths):
+        """
+        delete games (and their sources)
+        :param paths: [game path]
+        :return:
+        """
+        with self._lock:
+            self._conn.executemany('DELETE FROM games WHERE path=?', [(p,) for p in paths])
+            self._conn.executemany('DELETE FROM sources WHERE path=?', [(p,) for p in paths])
+            self._conn.commit()
+
+    def get_image_hashes(self):
+        """
+        get the content hashes of all the images
+        :return: { image path: hash }
+        """
+        with self._lock:
+            return dict(self._conn.execute('SELECT path, hash FROM images'))
+
+    def set_image(self, path, hash):
+        """
+        set the content hash of an image
+        :param path: the image path
+        :param hash: the content hash
+        :return:
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO images VALUES (?,?)', (path, hash))
+            self._conn.commit()
+
+    def add_scrape(self, path, engine, query, result):
+        """
+        record a scrape outcome
+        :param path: the game path
+        :param engine: the engine name
+        :param query: the searched name
+        :param result: scrape_title() result
+        :return:
+        """
+        with self._lock:
+            self._conn.execute('INSERT INTO scrapes VALUES (?,?,?,?,?)', (path, engine, query, result, time.time()))
+            self._conn.commit()
+
+    def get_search_variant(self, engine, query):
+        """
+        get the query variant which found a title
+        :param engine: the engine name
+        :param query: the original query
+        :return: the variant, or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT variant FROM searches WHERE engine=? AND query=?',
+                                     (engine, query)).fetchone()
+        return None if row is None else row[0]
+
+    def set_search_variant(self, engine, query, variant):
+        """
+        record the query variant which found a title
+        :param engine: the engine name
+        :param query: the original query
+        :param variant: the variant
+        :return:
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO searches VALUES (?,?,?,?)', (engine, query, variant, time.time()))
+            self._conn.commit()
+
+    def put_crcs(self, rows):
+        """
+        add/replace entries of the crc index
+        :param rows: iterable of (engine, crc32, size, name, url), engine '' and url None for titles from DAT files
+        :return:
+        """
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO crcs VALUES (?,?,?,?,?)', rows)
+            self._conn.commit()
+
+    def get_crc(self, engine, crc, size):
+        """
+        look up a file in the crc index, the engine own entries first
+        :param engine: the engine name
+        :param crc: the file crc32
+        :param size: the file size
+        :return: (name, url) or None, url may be None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT name, url FROM crcs WHERE engine IN (?, \'\') AND crc=? AND size=? '
+                                     'ORDER BY engine DESC LIMIT 1', (engine, crc, size)).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def get_listing(self, engine, query, max_age):
+        """
+        get the parsed results of a search
+        :param engine: the engine name
+        :param query: the query
+        :param max_age: maximum age, in seconds
+        :return: [{ name, publisher, year, url, system }] or None if not there (or too old)
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT rows FROM listings WHERE engine=? AND query=? AND ts>=?',
+                                     (engine, query, time.time() - max_age)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_listing(self, engine, query, rows):
+        """
+        add/replace the parsed results of a search
+        :param engine: the engine name
+        :param query: the query
+        :param rows: [{ name, publisher, year, url, system }]
+        :return:
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO listings VALUES (?,?,?,?)',
+                               (engine, query, json.dumps(rows), time.time()))
+            self._conn.commit()
+
+
+def open_cache():
+    """
+    open (or create) the shared cache at CACHE_PATH
+    :return: Store
+    """
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    return open_store(CACHE_PATH)
+
+
+def open_store(path):
+    """
+    open (or create) a store, reusing an already opened one
+    :param path: path to the store file
+    :return: Store
+    """
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = Store(path)
+        return _stores[path]
@@ -0,0 +1,305 @@
+"""
+es-vscraper logging: leveled, queue-backed (workers never block on the terminal), with a live status line and a jsonl sink
+
+MIT-LICENSE
+
+Copyright 2017, Valerio 'valerino' Lupi <xoanino@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished
+to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import shutil
+import sys
+import threading
+import time
+
+# the es-vscraper logger
+log = logging.getLogger('es-vscraper')
+
+# structured fields (passed as extra={...}) written to the jsonl sink
+FIELDS = ['event', 'path', 'engine', 'query', 'result']
+
+# status line refresh, in seconds (every STATUS_LOG_EVERY refreshes it is logged instead, when not on a terminal)
+STATUS_INTERVAL = 1.0
+STATUS_LOG_EVERY = 30
+
+# the terminal is shared by the listener thread, the status line and the prompts
+_term_lock = threading.RLock()
+_queue = None
+_listener = None
+_status = None
+
+# counters and gauges shown by the status line
+_stats_lock = threading.Lock()
+_stats = {'total': 0, 'done': 0, 'start': 0, 'cache_hits': 0, 'cache_misses': 0}
+_gauges = {}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    a record per line, as json: ts, level, thread, msg and the structured FIELDS
+    """
+
+    def format(self, record):
+        entry = {'ts': record.created, 'level': record.levelname, 'thread': record.threadName,
+                 'msg': record.getMessage()}
+        for f in FIELDS:
+            if hasattr(record, f):
+                entry[f] = getattr(record, f)
+        return json.dumps(entry)
+
+
+class ConsoleHandler(logging.Handler):
+    """
+    write to the current stdout (redirected by '--serve' jobs), keeping the status line below the messages
+    """
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            with _term_lock:
+                if _status is not None:
+                    _status.clear()
+                sys.stdout.write(msg + '\n')
+                sys.stdout.flush()
+                if _status is not None:
+                    _status.draw()
+        except Exception:
+            self.handleError(record)
+
+
+class StatusLine(threading.Thread):
+    """
+    the live status line: titles/sec and ETA, requests/sec per host, cache hit rate and queue depths.
+    redrawn on a terminal, logged every now and then otherwise
+    :param requests: callable returning { host: requests issued }
+    """
+
+    def __init__(self, requests):
+        super().__init__(daemon=True)
+        self._requests = requests
+        self._stream = sys.stderr
+        self._tty = hasattr(self._stream, 'isatty') and self._stream.isatty()
+        self._done = threading.Event()
+        self._start = time.time()
+        self._line = ''
+
+    def render(self):
+        """
+        build the status line
+        :return: string
+        """
+        now = time.time()
+        with _stats_lock:
+            stats = dict(_stats)
+            gauges = dict(_gauges)
+
+        parts = []
+        elapsed = max(now - (stats['start'] or self._start), 0.001)
+        rate = stats['done'] / elapsed
+        if stats['total'] > 0:
+            eta = '-'
+            if rate > 0:
+                eta = time.strftime('%H:%M:%S', time.gmtime((stats['total'] - stats['done']) / rate))
+            parts.append('%d/%d titles, %.2f/s, ETA %s' % (stats['done'], stats['total'], rate, eta))
+        else:
+            parts.append('%d titles, %.2f/s' % (stats['done'], rate))
+
+        # busiest hosts first
+        hosts = sorted(self._requests().items(), key=lambda h: -h[1])[:3]
+        if len(hosts) > 0:
+            parts.append(', '.join('%s %.1f req/s' % (h, n / max(now - self._start, 0.001)) for h, n in hosts))
+
+        lookups = stats['cache_hits'] + stats['cache_misses']
+        if lookups > 0:
+            parts.append('cache %d%%' % (100 * stats['cache_hits'] // lookups))
+        if len(gauges) > 0:
+            parts.append(', '.join('%s %d' % (name, fn()) for name, fn in sorted(gauges.items())))
+        return ' | '.join(parts)
+
+    def clear(self):
+        """
+        erase the status line (holding _term_lock)
+        :return:
+        """
+        if self._tty and len(self._line) > 0:
+            self._stream.write('\r\x1b[K')
+            self._stream.flush()
+
+    def draw(self):
+        """
+        (re)draw the status line (holding _term_lock)
+        :return:
+        """
+        if self._tty and len(self._line) > 0:
+            self._stream.write('\r' + self._line[:shutil.get_terminal_size().columns - 1])
+            self._stream.flush()
+
+    def run(self):
+        ticks = 0
+        while not self._done.wait(STATUS_INTERVAL):
+            ticks += 1
+            line = self.render()
+            if self._tty:
+                with _term_lock:
+                    self.clear()
+                    self._line = line
+                    self.draw()
+            elif ticks % STATUS_LOG_EVERY == 0:
+                log.info(line, extra={'event': 'status'})
+
+    def stop(self):
+        """
+        stop and erase the status line
+        :return:
+        """
+        self._done.set()
+        self.join()
+        with _term_lock:
+            self.clear()
+            self._line = ''
+
+
+def setup(level='info', jsonl_path=None, status=None):
+    """
+    route the es-vscraper logger through a queue to the console (and a jsonl file), replacing a previous setup
+    :param level: 'debug', 'info', 'warning' or 'error' (on the console, the jsonl file gets info at least)
+    :param jsonl_path: path to a jsonl file to append the records to, or None
+    :param status: callable returning { host: requests issued } to show the live status line, or None
+    :return:
+    """
+    global _queue, _listener, _status
+    shutdown()
+
+    console = ConsoleHandler()
+    console.setFormatter(logging.Formatter('%(message)s'))
+    console.setLevel(level.upper())
+    handlers = [console]
+    if jsonl_path is not None:
+        sink = logging.FileHandler(jsonl_path, encoding='utf-8')
+        sink.setFormatter(JsonFormatter())
+        sink.setLevel(min(console.level, logging.INFO))
+        handlers.append(sink)
+
+    # records below every handler level are dropped right away, by the worker
+    _queue = queue.Queue()
+    log.addHandler(logging.handlers.QueueHandler(_queue))
+    log.setLevel(min(h.level for h in handlers))
+    log.propagate = False
+    _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    with _stats_lock:
+        _stats.update({'total': 0, 'done': 0, 'start': 0, 'cache_hits': 0, 'cache_misses': 0})
+        _gauges.clear()
+    if status is not None:
+        _status = StatusLine(status)
+        _status.start()
+
+
+def flush():
+    """
+    wait until the queued records are written
+    :return:
+    """
+    if _queue is not None:
+        _queue.join()
+
+
+def shutdown():
+    """
+    write the queued records and stop the listener and the status line
+    :return:
+    """
+    global _queue, _listener, _status
+    if _status is not None:
+        _status.stop()
+        _status = None
+    if _listener is not None:
+        _listener.stop()
+        for h in _listener.handlers:
+            h.close()
+        _listener = None
+    for h in list(log.handlers):
+        log.removeHandler(h)
+    _queue = None
+
+
+@contextlib.contextmanager
+def terminal():
+    """
+    own the terminal (i.e. for a prompt): the queued records are written first, the status line is hidden and
+    the records logged meanwhile wait in the queue
+    :return:
+    """
+    flush()
+    with _term_lock:
+        if _status is not None:
+            _status.clear()
+        yield
+        if _status is not None:
+            _status.draw()
+
+
+def set_total(n):
+    """
+    set the number of titles to be processed, for the ETA (restarts the rate)
+    :param n: number of titles
+    :return:
+    """
+    with _stats_lock:
+        _stats.update({'total': n, 'done': 0, 'start': time.time()})
+
+
+def title_done():
+    """
+    count a processed title
+    :return:
+    """
+    with _stats_lock:
+        _stats['done'] += 1
+
+
+def cache_lookup(hit):
+    """
+    count a cache lookup, for the hit rate
+    :param hit: True on hit
+    :return:
+    """
+    with _stats_lock:
+        _stats['cache_hits' if hit else 'cache_misses'] += 1
+
+
+def add_gauge(name, fn):
+    """
+    show a value (i.e. a queue depth) on the status line
+    :param name: the name
+    :param fn: callable returning an int
+    :return:
+    """
+    with _stats_lock:
+        _gauges[name] = fn
+
+
+def remove_gauge(name):
+    """
+    stop showing a value on the status line
+    :param name: the name
+    :return:
+    """
+    with _stats_lock:
+        _gauges.pop(name, None)
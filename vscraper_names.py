@@ -0,0 +1,214 @@
+"""
+es-vscraper filenames normalization, to turn game filenames into search keys and hints
+
+MIT-LICENSE
+
+Copyright 2017, Valerio 'valerino' Lupi <xoanino@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished
+to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import re
+
+# a (...) or [...] tag, with the spaces before it
+TAG = re.compile(r'\s*([(\[])([^)\]]*)[)\]]')
+
+# tags contents, checked in order
+YEAR = re.compile(r'^((?:19|20)[0-9x]{2})(?:-[0-9x]{2}){0,2}$', re.I)
+DISK = re.compile(r'^(?:disk|disc|cd|side|tape)\s*([0-9a-z]+)(?:\s*of\s*[0-9]+)?$', re.I)
+REVISION = re.compile(r'^(?:rev\s*[0-9a-z.]+|v\s*[0-9]+(?:\.[0-9a-z]+)*|prg\s*[0-9]|r[0-9]+)$', re.I)
+REGION = re.compile(r'^(?:(?:usa|europe|japan|world|asia|korea|brazil|australia|canada|china|germany|france|'
+                    r'spain|italy|uk|netherlands|sweden|scandinavia|taiwan|hong kong|russia|'
+                    r'[ujewekgfsib]{1,4})(?:\s*,\s*|$))+$', re.I)
+LANGUAGE = re.compile(r'^[a-z]{2}(?:[,+][a-z]{2})*$', re.I)
+FLAG = re.compile(r'^(?:!|a|b|c|f|h|o|p|t|tr|cr|m|u|x|beta|proto|prototype|demo|sample|preview|unl|pd|'
+                  r'pirate|hack|alt|bootleg|trainer|aga|ocs|ecs|ntsc|pal|(?:[abcfhmoptx]|cr|tr)[0-9\s+].*|'
+                  r'(?:beta|proto|demo|alt|sample)\s.*|t[+-].*)$', re.I)
+
+# a revision/version at the end of the title (i.e. 'Turrican II v1.1')
+TITLE_REVISION = re.compile(r'\s+(?:v|rev\s*)[0-9]+(?:\.[0-9a-z]+)*$', re.I)
+
+# a trailing article (i.e. 'Legend of Zelda, The'), possibly before a subtitle
+TRAILING_ARTICLE = re.compile(r'^(.+?),\s*(the|a|an|die|der|das|le|la|les|l\'|el|il|los|las)(\s+-\s+.*)?$', re.I)
+
+
+def parse_filename(filename):
+    """
+    normalize a game filename (TOSEC, No-Intro and GoodTools naming) into a search key and hints
+    :param filename: the file name, with or without extension
+    :return: { name, year, publisher, regions, revision, disk, flags } (each except 'name' may be None/empty)
+    """
+    base = filename
+    stem, ext = os.path.splitext(filename)
+    if 0 < len(ext) <= 5 and ' ' not in ext:
+        base = stem
+
+    # the title is everything before the first tag
+    m = TAG.search(base)
+    title = base if m is None else base[:m.start()]
+    tags = [] if m is None else TAG.findall(base, m.start())
+
+    info = {'name': None, 'year': None, 'publisher': None, 'regions': [], 'revision': None, 'disk': None,
+            'flags': []}
+    after_year = False
+    for bracket, tag in tags:
+        tag = tag.strip()
+        if bracket == '[':
+            # dump flags, as in [!], [b1], [cr Fairlight], [t +2]
+            info['flags'].append(tag)
+        elif YEAR.match(tag):
+            year = YEAR.match(tag).group(1)
+            if 'x' not in year.lower():
+                info['year'] = year
+            after_year = True
+            continue
+        elif DISK.match(tag):
+            info['disk'] = DISK.match(tag).group(1)
+        elif REVISION.match(tag):
+            info['revision'] = tag
+        elif after_year and info['publisher'] is None and tag != '-':
+            # TOSEC: title (year)(publisher)
+            info['publisher'] = tag
+        elif REGION.match(tag):
+            info['regions'] += [r.strip() for r in tag.split(',')]
+        elif LANGUAGE.match(tag) or FLAG.match(tag):
+            info['flags'].append(tag)
+        after_year = False
+
+    # cleanup the title
+    title = ' '.join(title.replace('_', ' ').split())
+    m = TITLE_REVISION.search(title)
+    if m is not None and m.start() > 0:
+        if info['revision'] is None:
+            info['revision'] = m.group(0).strip()
+        title = title[:m.start()]
+    m = TRAILING_ARTICLE.match(title)
+    if m is not None:
+        title = '%s %s%s' % (m.group(2), m.group(1), m.group(3) or '')
+    info['name'] = title.strip() if len(title.strip()) > 0 else stem
+    return info
+
+
+def name_score(filename):
+    """
+    score how descriptive a filename is for searching (longer words, year and publisher tags are better)
+    :param filename: the file name
+    :return: int
+    """
+    info = parse_filename(filename)
+    score = len(' '.join(re.findall('[a-z]{2,}', info['name'].lower())))
+    if info['year'] is not None:
+        score += 10
+    if info['publisher'] is not None:
+        score += 10
+    return score
+
+
+def normalize_publisher(publisher):
+    """
+    normalize a publisher for comparison (lowercase alphanumeric, no company suffixes)
+    :param publisher: the publisher
+    :return: string
+    """
+    p = re.sub('[^0-9a-z]+', ' ', publisher.lower())
+    p = re.sub(r'\b(ltd|limited|inc|corp|corporation|co|gmbh|software|games|entertainment|the)\b', ' ', p)
+    return ' '.join(p.split())
+
+
+def pick_choice(choices, hints):
+    """
+    pick the choice agreeing with the year and publisher hints from a filename, if only one does
+    :param choices: [{ name, publisher, year, url, system }]
+    :param hints: from parse_filename()
+    :return: 0-based index, or None if no choice (or more than one) agrees
+    """
+    if hints is None or (hints['year'] is None and hints['publisher'] is None):
+        return None
+
+    publisher = normalize_publisher(hints['publisher']) if hints['publisher'] is not None else ''
+    scores = []
+    for c in choices:
+        score = 0
+        if hints['year'] is not None and str(c.get('year', '')).strip()[:4] == hints['year']:
+            score += 1
+        p = normalize_publisher(c.get('publisher') or '')
+        if len(publisher) > 0 and len(p) > 0 and (publisher in p or p in publisher):
+            score += 1
+        scores.append(score)
+
+    best = max(scores) if len(scores) > 0 else 0
+    if best == 0 or scores.count(best) > 1:
+        return None
+    return scores.index(best)
+
+
+# roman numerals, for numbered sequels
+ROMAN_NUMERALS = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X', 'XI', 'XII', 'XIII', 'XIV', 'XV',
+                  'XVI', 'XVII', 'XVIII', 'XIX', 'XX']
+
+# a roman or arabic number
+NUMERAL = re.compile(r'\b(?:[ivx]+|[0-9]+)\b', re.I)
+
+# a subtitle, after ' - ' or ': '
+SUBTITLE = re.compile(r'^(.+?)\s*(?:\s-\s|:\s).+$')
+
+# a leading article
+LEADING_ARTICLE = re.compile(r'^(the|a|an|die|der|das|le|la|les|el|il|los|las)\s+(.+)$', re.I)
+
+
+def swap_numerals(title):
+    """
+    swap the roman numerals of a title with arabic ones, or the other way round (the first word is kept)
+    :param title: the title
+    :return: string
+    """
+    def _swap(m):
+        w = m.group(0)
+        if m.start() == 0:
+            return w
+        if w.upper() in ROMAN_NUMERALS:
+            return str(ROMAN_NUMERALS.index(w.upper()) + 1)
+        if w.isdigit() and 1 <= int(w) <= len(ROMAN_NUMERALS):
+            return ROMAN_NUMERALS[int(w) - 1]
+        return w
+
+    return NUMERAL.sub(_swap, title)
+
+
+def query_variants(title):
+    """
+    variants of a query to retry with when it is not found, most likely first: without subtitle, with numerals
+    swapped (roman/arabic), with the leading article moved or dropped, without punctuation
+    :param title: the query
+    :return: generator of strings (no duplicates, the query itself excluded)
+    """
+    def _variants():
+        m = SUBTITLE.match(title)
+        main = m.group(1) if m is not None else title
+        yield main
+        yield swap_numerals(title)
+        yield swap_numerals(main)
+        m = LEADING_ARTICLE.match(main)
+        if m is not None:
+            yield '%s, %s' % (m.group(2), m.group(1))
+            yield m.group(2)
+
+        # as slugs (i.e. gamesdatabase) mangle them
+        yield re.sub(r'[^\w\s]', '', title.replace('&', 'and'))
+        yield re.sub(r'[^\w\s]', ' ', main)
+
+    seen = {title.lower()}
+    for v in _variants():
+        v = ' '.join(v.split())
+        if len(v) > 0 and v.lower() not in seen:
+            seen.add(v.lower())
+            yield v
@@ -17,14 +17,20 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import io
+import collections
+import random
+import hashlib
+import re
 from time import sleep
-from PIL import Image
 import select
 import sys
 import os
+import shutil
 import time
 import threading
-import urllib.request
+import urllib.parse
+
+# PIL, requests, urllib.request and email are imported by the functions using them, to keep startup fast
 
 if os.name == 'nt':
     import msvcrt
@@ -52,6 +58,23 @@ class GameNotFoundException(Exception):
     """
     pass
 
+
+class HostUnavailableException(ConnectionError):
+    """
+    raised when a host keeps failing after retries (the title should be retried later)
+    """
+    pass
+
+class RequestBudgetException(Exception):
+    """
+    raised by http_get() instead of issuing a request past the limit set with set_request_limit()
+    """
+    pass
+
+# raised by http_get() for the caller to handle (requeue the title, stop the variants): plugins falling back on
+# errors must re-raise them
+PROPAGATED_EXCEPTIONS = (HostUnavailableException, RequestBudgetException)
+
 def __input_with_timeout_win(prompt, timeout):
     """
     input with timeout, unix version (internal)
@@ -125,6 +148,66 @@ def get_csv_parameter(params, name):
     return ''
 
 
+# the fields a plugin may be asked for with '--fields' ('name' is always needed)
+FIELDS = ['name', 'developer', 'publisher', 'desc', 'genre', 'releasedate', 'image']
+
+
+def wants_field(args, field):
+    """
+    check if a field has been asked for ('--fields'), so plugins can skip the requests for the others
+    :param args: arguments from cmdline
+    :param field: one of FIELDS
+    :return: bool
+    """
+    fields = getattr(args, 'fields', None)
+    return fields is None or field in fields
+
+
+# the fields a search listing row may carry, as { game_info field: choice key }
+LISTING_FIELDS = {'name': 'name', 'publisher': 'publisher', 'releasedate': 'year'}
+
+
+def game_info_from_choice(choice, args):
+    """
+    build game_info straight from a search listing row, if the row carries every field asked for ('--fields')
+    :param choice: { name, publisher, year, url, system }
+    :param args: arguments from cmdline
+    :return: game_info dictionary with the fields asked for only, or None if the game page is needed
+    """
+    if getattr(args, 'fields', None) is None or 'name' not in choice:
+        return None
+
+    game_info = {'url': choice['url'], 'img_buffer': None}
+    for f in args.fields:
+        key = LISTING_FIELDS.get(f)
+        if key is None or len(str(choice.get(key) or '').strip()) == 0:
+            # not in the listing
+            return None
+        game_info[f] = str(choice[key]).strip()
+    return game_info
+
+
+def run_listing_choice(choice, args, run_direct_url):
+    """
+    get game_info for a search listing row, downloading the game page only if the row does not carry every field asked for
+    :param choice: { name, publisher, year, url, system }
+    :param args: arguments from cmdline
+    :param run_direct_url: the plugin run_direct_url()
+    :return: game_info dictionary
+    """
+    game_info = game_info_from_choice(choice, args)
+    if game_info is not None:
+        return game_info
+
+    game_info = run_direct_url(choice['url'], args)
+
+    # the listing fills what the game page lacks
+    for f, key in LISTING_FIELDS.items():
+        if len(str(game_info.get(f) or '').strip()) == 0 and len(str(choice.get(key) or '').strip()) > 0:
+            game_info[f] = str(choice[key]).strip()
+    return game_info
+
+
 def find_href(root, substring):
     """
     browse all 'a' tags for specific 'href'
@@ -178,6 +261,166 @@ def get_text_no_tags(tag, to_strip):
         t.replaceWith('')
     return tag.text
 
+def read_patterns(path):
+    """
+    read regexes from file, one per line (empty lines and lines starting with # are ignored)
+    :param path: path to the file
+    :return: [regex]
+    """
+    patterns = []
+    with open(path, 'r') as f:
+        for l in f:
+            l = l.strip()
+            if len(l) == 0 or l.startswith('#'):
+                continue
+            patterns.append(l)
+    return patterns
+
+
+class PatternSet:
+    """
+    a list of regexes, matching if any of them does. each regex is compiled on its own, so backreferences
+    and inline flags (i.e. '(?i)') keep working as written
+    :param patterns: [regex]
+    :param flags: re flags
+    """
+
+    def __init__(self, patterns, flags=0):
+        self._patterns = [re.compile(p, flags) for p in patterns]
+
+    def match(self, s):
+        """
+        match the regexes at the beginning of a string, in order
+        :param s: the string
+        :return: the first match object, or None
+        """
+        for p in self._patterns:
+            m = p.match(s)
+            if m is not None:
+                return m
+        return None
+
+    def match_index(self, s):
+        """
+        get which regex matches at the beginning of a string first
+        :param s: the string
+        :return: the index of the first matching regex, or -1
+        """
+        for i, p in enumerate(self._patterns):
+            if p.match(s) is not None:
+                return i
+        return -1
+
+
+def compile_patterns(patterns, flags=0):
+    """
+    compile a list of regexes into a matcher for any of them
+    :param patterns: [regex]
+    :param flags: re flags
+    :return: PatternSet
+    """
+    return PatternSet(patterns, flags)
+
+
+# preprocess rules actions
+RULE_ACTIONS = ('include', 'exclude', 'move')
+
+
+def read_rules(path):
+    """
+    read preprocess rules from file, one per line as 'include REGEX', 'exclude REGEX' or 'move BUCKET REGEX'
+    (empty lines and lines starting with # are ignored)
+    :param path: path to the file
+    :return: [(action, bucket, regex)], bucket is None unless action is 'move'
+    """
+    rules = []
+    with open(path, 'r') as f:
+        for n, l in enumerate(f, 1):
+            l = l.strip()
+            if len(l) == 0 or l.startswith('#'):
+                continue
+            parts = l.split(None, 1)
+            action = parts[0].lower()
+            if action == 'move' and len(parts) == 2:
+                parts = [action] + parts[1].split(None, 1)
+            if action not in RULE_ACTIONS or len(parts) != (3 if action == 'move' else 2):
+                raise ValueError('%s, line %d: invalid rule "%s"' % (path, n, l))
+            if action == 'move':
+                rules.append((action, parts[1], parts[2]))
+            else:
+                rules.append((action, None, parts[1]))
+    return rules
+
+
+def compile_rules(rules, flags=0):
+    """
+    compile ordered rules, where the first matching rule wins. each rule regex is compiled on its own (as in
+    compile_patterns()), so backreferences and inline flags keep working
+    :param rules: [(action, bucket, regex)]
+    :param flags: re flags
+    :return: PatternSet, match_index() gives the index of the matching rule
+    """
+    return PatternSet([r[2] for r in rules], flags)
+
+
+def move_file(src, dst):
+    """
+    move file, ignoring errors
+    :param src: path to the file
+    :param dst: destination path
+    :return: True if moved
+    """
+    try:
+        shutil.move(src, dst)
+        return True
+    except Exception as e:
+        return False
+
+
+def read_archive_members(path):
+    """
+    list the files in a .zip (or .7z, if py7zr is installed) archive, reading only its directory
+    :param path: path to the archive
+    :return: [(name, size, crc32)], or None if not a (readable) archive
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.zip':
+            import mmap
+            import zipfile
+
+            # only the pages holding the central directory are actually read
+            with open(path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with zipfile.ZipFile(mm) as z:
+                        return [(i.filename, i.file_size, i.CRC) for i in z.infolist() if not i.is_dir()]
+
+        if ext == '.7z':
+            try:
+                import py7zr
+            except ImportError:
+                return None
+            with py7zr.SevenZipFile(path, 'r') as z:
+                return [(i.filename, i.uncompressed, i.crc32) for i in z.list() if not i.is_directory]
+
+    except Exception as e:
+        pass
+    return None
+
+
+def remove_file(path):
+    """
+    delete file, ignoring errors
+    :param path: path to the file
+    :return: True if deleted
+    """
+    try:
+        os.remove(path)
+        return True
+    except Exception as e:
+        return False
+
+
 def write_to_file(path, buffer):
     """
     write buffer to file
@@ -207,6 +450,8 @@ def download_file(url, path, no_overwrite):
     :param no_overwrite: if true, just exits if the file already exists
     :return: -1 if path exists
     """
+    import urllib.request
+
     if no_overwrite == True:
         if os.path.exists(path):
             return -1
@@ -226,18 +471,72 @@ def download_file(url, path, no_overwrite):
         raise Exception('Download error!')
 
 
+class ByteBudget:
+    """
+    a cap on the bytes held in flight by all the threads
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        """
+        wait until n bytes fit in the budget (a request larger than the whole budget runs alone)
+        :param n: number of bytes
+        :return:
+        """
+        with self._cond:
+            while self._used > 0 and self._used + n > self.limit:
+                self._cond.wait()
+            self._used += n
+
+    def release(self, n):
+        """
+        give back n bytes to the budget
+        :param n: number of bytes
+        :return:
+        """
+        with self._cond:
+            self._used -= n
+            self._cond.notify_all()
+
+
+# budget for the images being converted
+_inflight = ByteBudget(64 * 1024 * 1024)
+
+
+def set_max_inflight_bytes(n):
+    """
+    set the maximum bytes held by the images being converted at once
+    :param n: number of bytes
+    :return:
+    """
+    _inflight.limit = n
+
+
 def img_to_png(buffer):
     """
     convert an image buffer to PNG
     :param buffer: the image
     :return: PNG image buffer or None
     """
+    from PIL import Image
+
     if buffer is None:
         return None
     try:
         img_buffer = io.BytesIO()
         tmp = Image.open(io.BytesIO(buffer))
-        tmp.save(img_buffer, 'png')
+
+        # the decoded image is the largest allocation, account for it before loading
+        size = len(buffer) + tmp.width * tmp.height * 4
+        _inflight.acquire(size)
+        try:
+            tmp.save(img_buffer, 'png')
+        finally:
+            _inflight.release(size)
         if len(img_buffer.getvalue()) > 0:
             return img_buffer.getvalue()
         return None
@@ -245,3 +544,539 @@ def img_to_png(buffer):
     except Exception as e:
         return None
 
+
+# folder (inside the images folder) holding the content-addressed image blobs
+BLOBS_FOLDER = '.blobs'
+
+
+def get_image_blob(img_dir, buffer):
+    """
+    get the path of the content-addressed blob for an image buffer, storing it if needed
+    :param img_dir: the images folder
+    :param buffer: the image
+    :return: path to the blob
+    """
+    blobs_dir = os.path.join(img_dir, BLOBS_FOLDER)
+    os.makedirs(blobs_dir, exist_ok=True)
+    blob = os.path.join(blobs_dir, '%s.png' % hashlib.sha1(buffer).hexdigest())
+    if not os.path.exists(blob):
+        # write to a temporary first, so concurrent writers never see a partial blob
+        tmp = '%s.%d.%d.tmp' % (blob, os.getpid(), threading.get_ident())
+        write_to_file(tmp, buffer)
+        os.replace(tmp, blob)
+    return blob
+
+
+def get_image_variant_blobs(blob, sizes):
+    """
+    get the downscaled variants of an image blob, storing the missing ones. The image is decoded once and
+    downscaled progressively (each variant from the previous, larger one)
+    :param blob: path to the blob
+    :param sizes: [int], longest side of each variant in pixels
+    :return: { size: path to the variant blob }, linked to the blob itself for sizes not smaller than the image
+    """
+    from PIL import Image
+
+    variants = {}
+    todo = []
+    for size in sizes:
+        variants[size] = '%s_%d.png' % (os.path.splitext(blob)[0], size)
+        if not os.path.exists(variants[size]):
+            todo.append(size)
+    if len(todo) == 0:
+        return variants
+
+    with Image.open(blob) as img:
+        need = img.width * img.height * 4
+        _inflight.acquire(need)
+        try:
+            current = img
+            for size in sorted(todo, reverse=True):
+                if max(img.size) <= size:
+                    # never upscale, the original is recorded as this size (so it is not decoded again next time)
+                    link_image_blob(blob, variants[size])
+                    continue
+
+                current = current.copy()
+                current.thumbnail((size, size), Image.LANCZOS)
+                tmp = '%s.%d.%d.tmp' % (variants[size], os.getpid(), threading.get_ident())
+                current.save(tmp, 'png')
+                os.replace(tmp, variants[size])
+        finally:
+            _inflight.release(need)
+    return variants
+
+
+def link_image_blob(blob, path):
+    """
+    make path point to blob (hardlink, or symlink/copy where hardlinks are not supported)
+    :param blob: path to the blob
+    :param path: the image path
+    :return:
+    """
+    try:
+        if os.path.samefile(blob, path):
+            # already there, nothing to write
+            return
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.link(blob, path)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(blob, os.path.dirname(path)), path)
+        except OSError:
+            write_to_file(path, read_from_file(blob))
+
+
+def gc_image_blobs(img_dir, referenced, hashes=None, test=False):
+    """
+    delete the images in the images folder which are not referenced by any entry anymore, and then the blobs
+    no remaining image is stored as
+    :param img_dir: the images folder
+    :param referenced: set of absolute image paths referenced by the entries (<image>, <thumbnail>). The size
+        variants linked alongside (<image name>_<size>.png) are kept with their image
+    :param hashes: optional { absolute image path: blob name } as recorded in the store, for images stored as copies
+    :param test: if True, do not delete anything
+    :return: (deleted images count, deleted blobs count, freed bytes)
+    """
+    if hashes is None:
+        hashes = {}
+    blobs_dir = os.path.join(img_dir, BLOBS_FOLDER)
+
+    # an image and its size variants share the same base name
+    bases = set()
+    for path in referenced:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        bases.add(stem)
+        bases.add(re.sub(r'_\d+$', '', stem))
+
+    images = 0
+    freed = 0
+    blob_refs = set()
+    for e in os.scandir(img_dir):
+        if e.name == BLOBS_FOLDER or not (e.is_file() or e.is_symlink()):
+            continue
+        stem = os.path.splitext(e.name)[0]
+        path = os.path.abspath(e.path)
+        if path not in referenced and stem not in bases and re.sub(r'_\d+$', '', stem) not in bases:
+            # left behind by a purged/renamed entry
+            images += 1
+            if not e.is_symlink():
+                st = e.stat()
+                if st.st_nlink == 1:
+                    freed += st.st_size
+            if not test:
+                os.remove(e.path)
+            continue
+
+        # collect the blob the image is stored as
+        if e.is_symlink():
+            blob_refs.add(os.path.realpath(e.path))
+            continue
+        st = e.stat()
+        blob_refs.add((st.st_dev, st.st_ino))
+        if path in hashes:
+            blob_refs.add(hashes[path])
+        elif st.st_nlink == 1:
+            # a copy (no hardlinks/symlinks on this filesystem), stored by content
+            blob_refs.add(hashlib.sha1(read_from_file(e.path)).hexdigest())
+
+    blobs = 0
+    if os.path.isdir(blobs_dir):
+        for e in os.scandir(blobs_dir):
+            st = e.stat()
+            if ((st.st_dev, st.st_ino) in blob_refs or os.path.realpath(e.path) in blob_refs or
+                    os.path.splitext(e.name)[0] in blob_refs):
+                continue
+            blobs += 1
+            freed += st.st_size
+            if not test:
+                os.remove(e.path)
+
+    return images, blobs, freed
+
+
+# shared http session (connection pooling across requests)
+_session = None
+
+# requests timeout, in seconds
+HTTP_TIMEOUT = 30
+
+# attempts for each request, on transient errors
+HTTP_RETRIES = 4
+
+# exponential backoff base and cap between attempts, in seconds
+HTTP_BACKOFF = 2
+HTTP_BACKOFF_MAX = 60
+
+# replies worth a retry
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+# maximum concurrent requests per host
+_max_host_concurrency = 1
+
+# per-host concurrency controllers, by host
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+# validators (etag, last-modified, content hash) of the last 200 reply for each url, least recently set first
+_validators = collections.OrderedDict()
+
+# replies already fetched while revalidating, consumed by the next http_get() on the same url
+_prefetched = collections.OrderedDict()
+_replies_lock = threading.Lock()
+
+# urls remembered in _validators/_prefetched, the oldest are dropped past this (long --serve/--watch sessions)
+MAX_REMEMBERED_URLS = 1024
+
+# requests issued by each thread, for per-title budgets
+_thread_requests = threading.local()
+
+# requests issued, by host
+_host_requests = {}
+_host_requests_lock = threading.Lock()
+
+
+class HostController:
+    """
+    adaptive (AIMD) concurrency limit for a host: the limit grows by one request per round of healthy
+    replies, and is halved on 429/503, timeouts and connection errors, or when p95 latency rises.
+    also a circuit breaker: after too many consecutive failures the host is considered down, and
+    requests are paused until a cooldown (doubling while the host keeps failing) expires
+    """
+
+    # consecutive failures opening the circuit
+    BREAKER_FAILURES = 5
+
+    # first and maximum cooldown, in seconds
+    BREAKER_COOLDOWN = 30
+    BREAKER_COOLDOWN_MAX = 600
+
+    # latencies kept to compute p95
+    SAMPLES = 50
+
+    # p95 over the best one seen by this factor means the host is struggling
+    LATENCY_FACTOR = 2.0
+
+    def __init__(self, max_limit):
+        self._cond = threading.Condition()
+        self._latencies = collections.deque(maxlen=HostController.SAMPLES)
+        self._best_p95 = None
+        self._last_decrease = 0
+        self._in_flight = 0
+        self._not_before = 0
+        self._failures = 0
+        self._cooldown = HostController.BREAKER_COOLDOWN
+        self.limit = 1.0
+        self.max_limit = max_limit
+
+    def acquire(self):
+        """
+        wait for a free slot (and for any Retry-After to expire)
+        :return:
+        """
+        with self._cond:
+            while True:
+                wait = self._not_before - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self._in_flight < int(self.limit):
+                    self._in_flight += 1
+                    return
+                else:
+                    self._cond.wait()
+
+    def _p95(self):
+        """
+        p95 latency of the last replies (internal)
+        """
+        l = sorted(self._latencies)
+        return l[int(len(l) * 0.95)]
+
+    def release(self, latency, status):
+        """
+        release a slot, adapting the limit
+        :param latency: request latency, in seconds
+        :param status: the reply status code, or None on timeouts/connection errors
+        :return:
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if status is None or status in TRANSIENT_STATUS:
+                self._failures += 1
+                if self._failures >= HostController.BREAKER_FAILURES:
+                    # host is down, pause it
+                    self._not_before = max(self._not_before, time.time() + self._cooldown)
+                    self._cooldown = min(self._cooldown * 2, HostController.BREAKER_COOLDOWN_MAX)
+                    self._failures = 0
+            else:
+                self._failures = 0
+                self._cooldown = HostController.BREAKER_COOLDOWN
+
+            healthy = status is not None and status not in (429, 503)
+            if healthy:
+                self._latencies.append(latency)
+                if len(self._latencies) >= 10:
+                    p95 = self._p95()
+                    if self._best_p95 is None or p95 < self._best_p95:
+                        self._best_p95 = p95
+                    elif p95 > self._best_p95 * HostController.LATENCY_FACTOR:
+                        healthy = False
+
+            now = time.time()
+            if healthy:
+                # additive increase, about one slot per round of replies at the current limit
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            elif now - self._last_decrease > latency:
+                # multiplicative decrease, once per round trip
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+            self._cond.notify_all()
+
+    def cancel(self):
+        """
+        release a slot taken by a request which failed on our side (invalid url, too many redirects, ...), leaving
+        the limit and the breaker untouched
+        :return:
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def retry_after(self, seconds):
+        """
+        pause requests to the host
+        :param seconds: seconds to wait
+        :return:
+        """
+        with self._cond:
+            self._not_before = max(self._not_before, time.time() + seconds)
+
+
+def set_max_host_concurrency(n):
+    """
+    set the maximum concurrent requests per host
+    :param n: number of requests
+    :return:
+    """
+    import requests
+
+    global _max_host_concurrency
+    _max_host_concurrency = n
+    with _hosts_lock:
+        for h in _hosts.values():
+            h.max_limit = n
+
+    # enough pooled connections for every worker
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, n))
+    _get_session().mount('http://', adapter)
+    _get_session().mount('https://', adapter)
+
+
+def get_host_controller(host):
+    """
+    get the concurrency controller for a host
+    :param host: the host
+    :return: HostController
+    """
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = HostController(_max_host_concurrency)
+        return _hosts[host]
+
+
+def parse_retry_after(value):
+    """
+    parse a Retry-After header
+    :param value: the header value (seconds or http date), may be None
+    :return: seconds, or None
+    """
+    import email.utils
+
+    if value is None:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception as e:
+        return None
+
+
+def _get_session():
+    """
+    get the shared requests session (internal)
+    :return: requests.Session
+    """
+    import requests
+
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def http_get(url, params=None, headers=None):
+    """
+    issue a GET request using the shared session, remembering the validators of the reply.
+    transient errors (connection errors, timeouts, 429 and 5xx) are retried with exponential backoff
+    :param url: the url
+    :param params: query parameters, may be None
+    :param headers: additional request headers, may be None
+    :throws RequestBudgetException past the limit set with set_request_limit()
+    :throws HostUnavailableException when the request keeps failing, requests.exceptions.RequestException at once on
+        anything else (invalid url, too many redirects, ...)
+    :return: the reply
+    """
+    import requests
+
+    if params is None and headers is None:
+        with _replies_lock:
+            reply = _prefetched.pop(url, None)
+        if reply is not None:
+            # already downloaded while revalidating
+            return reply
+
+    limit = getattr(_thread_requests, 'limit', None)
+    if limit is not None and get_request_count() >= limit:
+        # checked before the request, so the budget is never exceeded
+        raise RequestBudgetException('request budget exhausted (%d requests)' % limit)
+
+    _thread_requests.count = get_request_count() + 1
+    netloc = urllib.parse.urlparse(url).netloc
+    with _host_requests_lock:
+        _host_requests[netloc] = _host_requests.get(netloc, 0) + 1
+    host = get_host_controller(netloc)
+    for attempt in range(HTTP_RETRIES):
+        if attempt > 0:
+            # backoff with full jitter
+            time.sleep(random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt)))
+
+        host.acquire()
+        start = time.time()
+        try:
+            reply = _get_session().get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            # transient, retried
+            host.release(time.time() - start, None)
+            error = e
+            continue
+        except BaseException:
+            # not the host being down (invalid url, too many redirects, ...), fail at once
+            host.cancel()
+            raise
+        status = reply.status_code
+        host.release(time.time() - start, status)
+
+        if status in (429, 503):
+            # honour the server request to slow down
+            seconds = parse_retry_after(reply.headers.get('Retry-After'))
+            if seconds is not None:
+                host.retry_after(seconds)
+
+        if status not in TRANSIENT_STATUS:
+            break
+        error = None
+    else:
+        raise HostUnavailableException('%s is not responding (%s)' % (
+            url, 'status %d' % status if error is None else error))
+
+    if reply.status_code == 200:
+        v = {'etag': reply.headers.get('ETag'),
+             'last_modified': reply.headers.get('Last-Modified'),
+             'content_hash': hashlib.sha1(reply.content).hexdigest()}
+        _remember(_validators, reply.url, v)
+        if params is None:
+            _remember(_validators, url, v)
+
+    return reply
+
+
+def _remember(d, url, value):
+    """
+    set an url in one of the bounded per-url dictionaries, dropping the least recently set past MAX_REMEMBERED_URLS
+    :param d: _validators or _prefetched
+    :param url: the url
+    :param value: the value
+    :return:
+    """
+    with _replies_lock:
+        d[url] = value
+        d.move_to_end(url)
+        while len(d) > MAX_REMEMBERED_URLS:
+            d.popitem(last=False)
+
+
+def get_request_count():
+    """
+    get the number of requests issued by the current thread
+    :return: int
+    """
+    return getattr(_thread_requests, 'count', 0)
+
+
+def set_request_limit(n):
+    """
+    limit the requests issued by the current thread (for per-title budgets): past it, http_get() raises
+    RequestBudgetException instead of issuing the request
+    :param n: the maximum get_request_count(), or None for no limit
+    :return:
+    """
+    _thread_requests.limit = n
+
+
+def get_host_requests():
+    """
+    get the number of requests issued to each host
+    :return: { host: int }
+    """
+    with _host_requests_lock:
+        return dict(_host_requests)
+
+
+def get_validators(url):
+    """
+    get the validators recorded for an url by http_get()
+    :param url: the url
+    :return: { etag, last_modified, content_hash } or None
+    """
+    with _replies_lock:
+        return _validators.get(url)
+
+
+def is_unchanged(url, validators):
+    """
+    revalidate an url with a conditional GET
+    :param url: the url
+    :param validators: { etag, last_modified, content_hash } as returned by get_validators()
+    :return: True if the server replied 304 or the content hash is unchanged
+    """
+    headers = {}
+    if validators['etag']:
+        headers['If-None-Match'] = validators['etag']
+    if validators['last_modified']:
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    reply = http_get(url, headers=headers)
+    if reply.status_code == 304:
+        return True
+
+    if not reply.ok:
+        return False
+
+    if hashlib.sha1(reply.content).hexdigest() == validators['content_hash']:
+        return True
+
+    # changed, keep the reply for the plugin to avoid downloading it twice
+    _remember(_prefetched, url, reply)
+    return False
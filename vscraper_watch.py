@@ -0,0 +1,176 @@
+"""
+es-vscraper folder watcher, to scrape new files as they appear
+
+MIT-LICENSE
+
+Copyright 2017, Valerio 'valerino' Lupi <xoanino@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished
+to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import vscraper_log
+
+# inotify events (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event header: wd, mask, cookie, len (followed by the nul-padded name)
+EVENT_HEADER = struct.Struct('iIII')
+
+# seconds between scans, when inotify is not available
+POLL_INTERVAL = 2
+
+
+def scan_folder(path):
+    """
+    get the files in a folder
+    :param path: the folder
+    :return: { name: (size, mtime) }
+    """
+    files = {}
+    with os.scandir(path) as it:
+        for e in it:
+            if e.is_file():
+                st = e.stat()
+                files[e.name] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def diff_scans(old, new):
+    """
+    compare two scan_folder() results
+    :param old: the previous scan
+    :param new: the current scan
+    :return: [(name, changed)], changed is False for files deleted or moved away
+    """
+    events = [(name, True) for name, st in new.items() if old.get(name) != st]
+    events += [(name, False) for name in old if name not in new]
+    return events
+
+
+class InotifyWatcher:
+    """
+    watches the files in a folder (not recursive) through inotify
+    """
+
+    def __init__(self, path):
+        self._path = path
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, 'inotify_add_watch failed on %s' % path)
+
+        # last known state of the folder, to catch up when the kernel queue overflows and events are lost
+        self._files = scan_folder(path)
+
+    def wait(self, timeout=None):
+        """
+        wait for changes
+        :param timeout: seconds, None to wait forever
+        :return: [(name, changed)], changed is False for files deleted or moved away
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if len(ready) == 0:
+            return []
+
+        buf = os.read(self._fd, 64 * 1024)
+        events = []
+        overflow = False
+        pos = 0
+        while pos < len(buf):
+            _, mask, _, n = EVENT_HEADER.unpack_from(buf, pos)
+            name = os.fsdecode(buf[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + n].rstrip(b'\0'))
+            pos += EVENT_HEADER.size + n
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_ISDIR or name == '':
+                # only files
+                continue
+            events.append((name, not mask & (IN_MOVED_FROM | IN_DELETE)))
+
+        if overflow:
+            # events were dropped, rescan the whole folder
+            files = scan_folder(self._path)
+            events = diff_scans(self._files, files)
+            self._files = files
+            return events
+
+        for name in set(name for name, _ in events):
+            try:
+                st = os.stat(os.path.join(self._path, name))
+                self._files[name] = (st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                self._files.pop(name, None)
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    watches the files in a folder (not recursive) by comparing scans, where inotify is not available
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._files = scan_folder(path)
+
+    def wait(self, timeout=None):
+        """
+        wait for changes
+        :param timeout: seconds, None to wait until the next scan
+        :return: [(name, changed)], changed is False for files deleted or moved away
+        """
+        time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+        files = scan_folder(self._path)
+        events = diff_scans(self._files, files)
+        self._files = files
+        return events
+
+    def close(self):
+        pass
+
+
+def open_watcher(path):
+    """
+    watch the files in a folder, through inotify if available or else polling
+    :param path: the folder
+    :return: InotifyWatcher or PollingWatcher
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            vscraper_log.log.warning('inotify not available (%s), polling %s', e, path)
+    return PollingWatcher(path)